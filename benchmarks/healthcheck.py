@@ -0,0 +1,161 @@
+# Copyright © 2015 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+"""
+Exercises the health-checked cutover of :meth:`AppLing.start` against a
+local WSGI stand-in for the new zergling.
+
+A :mod:`wsgiref` server listens on the private HTTP socket of the new
+appling, while the in-memory stand-in for :mod:`score.uwsgi` from
+:mod:`stub_uwsgi` keeps track of the zerglings' states. Each scenario
+checks whether the old zergling was paused (check passed) or kept running
+with the new one stopped (rolled back)::
+
+    python benchmarks/healthcheck.py
+"""
+
+import os
+import shutil
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.dirname(here))
+
+import stub_uwsgi  # noqa
+stub_uwsgi.install()
+
+import score.deploy  # noqa
+from score.deploy._app import AppLing  # noqa
+
+
+class UnixWSGIServer(WSGIServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 80
+        self.setup_environ()
+
+
+class Handler(WSGIRequestHandler):
+
+    def setup(self):
+        super().setup()
+        self.client_address = ('local', 0)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_app(status='200 OK', delay=0, warmup_status='200 OK'):
+    def app(environ, start_response):
+        if '/warmup/' in environ['PATH_INFO']:
+            start_response(warmup_status, [('Content-Type', 'text/plain')])
+            return [b'warm']
+        time.sleep(delay)
+        start_response(status, [('Content-Type', 'text/plain')])
+        return [b'ok']
+    return app
+
+
+scenarios = [
+    # name, wsgi app (None: nothing listening), expected to pass
+    ('healthy', make_app(), True),
+    ('unreachable', None, False),
+    ('error status', make_app(status='500 Internal Server Error'), False),
+    ('failing warmup', make_app(warmup_status='404 Not Found'), False),
+    ('over budget', make_app(delay=0.3), False),
+]
+
+
+def run(tmpdir, name, wsgi_app, expected):
+    folder = tempfile.mkdtemp(dir=tmpdir)
+    root = os.path.join(folder, 'root')
+    os.makedirs(root)
+    conf = {
+        'rootdir': root,
+        'app.hg': os.path.join(folder, 'unused'),
+        'app.ini': 'app.ini',
+        'app.health.url': 'http://localhost/health/{name}',
+        'app.health.warmup': 'warmup/a warmup/b',
+        'app.health.budget': '0.2',
+        'app.health.timeout': '1',
+    }
+    uwsgi = stub_uwsgi.ConfiguredUwsgiModule(folder)
+    deploy = score.deploy.init(conf, uwsgi)
+    app = deploy.apps['app']
+    for ling in ('old', 'new'):
+        uwsgi.Zergling(app.overlord, ling, 'app.ini').start()
+    new = AppLing(app, 'new')
+    server = None
+    if wsgi_app is not None:
+        server = UnixWSGIServer(new.health_socket, Handler)
+        server.set_app(wsgi_app)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        try:
+            new._cutover(True, False)
+            passed = True
+        except Exception as e:
+            passed = False
+            print('    %s' % e)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    states = dict((zergling.name, zergling.state)
+                  for zergling in app.overlord.zerglings())
+    # the registry must not claim a rolled back zergling is running
+    registered = deploy.registry.load().get('app', {}).get('new', {})
+    if expected:
+        ok = passed and states == {'old': 'paused', 'new': 'running'} and \
+            registered.get('state') == 'running'
+    else:
+        ok = not passed and states == {'old': 'running', 'new': 'stopped'} \
+            and registered.get('state') != 'running'
+    print('%-4s %-16s %s' % ('ok' if ok else 'FAIL', name, states))
+    return ok
+
+
+def main():
+    tmpdir = tempfile.mkdtemp(prefix='score-deploy-health-')
+    try:
+        results = [run(tmpdir, *scenario) for scenario in scenarios]
+    finally:
+        shutil.rmtree(tmpdir)
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
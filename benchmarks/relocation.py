@@ -0,0 +1,172 @@
+# Copyright © 2015 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+"""
+Checks that the virtualenv of every appling resolves the project to the
+appling's own folder, however the folder was provided.
+
+Creates applings of a local git repository with real virtualenvs, while the
+in-memory stand-in for :mod:`score.uwsgi` from :mod:`stub_uwsgi` replaces
+the zerglings. After each step, the package of the project is imported
+with the python of every appling's virtualenv and all absolute paths in the
+virtualenvs are checked to point into the appling's own folder::
+
+    python benchmarks/relocation.py
+
+Requires ``git`` and ``virtualenv`` on the PATH.
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.dirname(here))
+
+import stub_uwsgi  # noqa
+stub_uwsgi.install()
+
+import score.deploy  # noqa
+from score.deploy._venv import _relocatable_files  # noqa
+
+
+setup_py = '''
+from setuptools import setup
+setup(name='relocapp', version='0.0', packages=['relocapp'])
+'''
+
+
+def git(*args, cwd=None):
+    subprocess.check_call(('git',) + args, cwd=cwd,
+                          stdout=subprocess.DEVNULL)
+
+
+def make_repository(folder):
+    os.makedirs(os.path.join(folder, 'relocapp'))
+    with open(os.path.join(folder, 'setup.py'), 'w') as fp:
+        fp.write(setup_py)
+    with open(os.path.join(folder, 'app.ini'), 'w') as fp:
+        fp.write('[app:main]\nuse = egg:relocapp\n')
+    with open(os.path.join(folder, 'relocapp', '__init__.py'), 'w') as fp:
+        fp.write('')
+    git('init', '--quiet', cwd=folder)
+    git('add', '.', cwd=folder)
+    git('-c', 'user.name=reloc', '-c', 'user.email=reloc@localhost',
+        'commit', '--quiet', '-m', 'initial', cwd=folder)
+
+
+def problems(app, appling):
+    """
+    Returns a list of all places, where the virtualenv of *appling* refers
+    to a folder other than its own.
+    """
+    found = []
+    venvpath = os.path.join(appling.folder, '.venv')
+    proc = subprocess.run(
+        [os.path.join(venvpath, 'bin', 'python'), '-c',
+         'import relocapp; print(relocapp.__file__)'],
+        cwd='/', stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    module = proc.stdout.decode('utf-8').strip()
+    if proc.returncode:
+        found.append('relocapp cannot be imported')
+    elif not module.startswith(appling.folder + os.sep):
+        found.append('relocapp imported from %s' % module)
+    pattern = re.escape(app.folder.encode('utf-8')) + rb'/([^/"\'\s]+)'
+    for file in _relocatable_files(venvpath):
+        if os.stat(file).st_nlink > 1:
+            found.append('%s shares its inode' % (
+                os.path.relpath(file, appling.folder)))
+        with open(file, 'rb') as fp:
+            content = fp.read()
+        for folder in set(re.findall(pattern, content)):
+            if folder.decode('utf-8') != appling.name:
+                found.append('%s refers to %s' % (
+                    os.path.relpath(file, appling.folder),
+                    folder.decode('utf-8')))
+    return found
+
+
+def from_spare(app, name):
+    app.spares = 1
+    app.replenish()
+    assert app.spare_folders(), 'no spare folder was built'
+    # keep mkling from building the next spare in the background
+    app.spares = 0
+    return app.mkling(name)
+
+
+steps = [
+    # name of the new appling, function creating it
+    ('alpha', lambda app, name: app.mkling(name)),
+    # the virtualenv is copied from the cache
+    ('beta', lambda app, name: app.mkling(name)),
+    ('gamma', from_spare),
+    ('delta', lambda app, name: app.mkling(
+        name, source=app.appling('alpha'))),
+]
+
+
+def main():
+    tmpdir = tempfile.mkdtemp(prefix='score-deploy-relocation-')
+    try:
+        repository = os.path.join(tmpdir, 'repository')
+        make_repository(repository)
+        root = os.path.join(tmpdir, 'root')
+        logdir = os.path.join(tmpdir, 'logs')
+        os.makedirs(root)
+        os.makedirs(logdir)
+        conf = {
+            'rootdir': root,
+            'app.git': repository,
+            'app.ini': 'app.ini',
+        }
+        uwsgi = stub_uwsgi.ConfiguredUwsgiModule(logdir)
+        deploy = score.deploy.init(conf, uwsgi)
+        app = deploy.apps['app']
+        app.initialize()
+        applings = []
+        ok = True
+        for name, create in steps:
+            applings.append(create(app, name))
+            # creating an appling must not affect the existing ones
+            for appling in applings:
+                found = problems(app, appling)
+                ok = ok and not found
+                print('%-4s %-6s %s' % ('FAIL' if found else 'ok',
+                                        name, appling.name))
+                for problem in found:
+                    print('    %s' % problem)
+    finally:
+        shutil.rmtree(tmpdir)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+# Copyright © 2015 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+"""
+Hermetic benchmarks of the deployment operations.
+
+Builds a local Mercurial repository as fixture, replaces :mod:`score.uwsgi`
+with the in-memory stand-in in :mod:`stub_uwsgi` and measures the duration
+of the central operations for a growing number of apps and applings. The
+results are written as JSON and can be compared to a previous run::
+
+    python benchmarks/run.py -o before.json
+    python benchmarks/run.py -o after.json --compare before.json
+
+Requires ``hg`` and ``virtualenv`` on the PATH (the latter only for the
+``mkling`` benchmark).
+
+The startup time of the command line interface cannot be measured with the
+stand-in, it needs a real configuration file and the name of an existing
+appling::
+
+    python benchmarks/run.py --startup deploy.conf myapp/alpha
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.dirname(here))
+
+import stub_uwsgi  # noqa
+stub_uwsgi.install()
+
+import score.deploy  # noqa
+from score.deploy._status import StatusCache, collect_status  # noqa
+from score.deploy.cli import get_appling  # noqa
+
+
+setup_py = '''
+from setuptools import setup
+setup(name='benchapp', version='0.0', packages=['benchapp'])
+'''
+
+
+def hg(*args, cwd=None):
+    subprocess.check_call(('hg',) + args, cwd=cwd,
+                          stdout=subprocess.DEVNULL)
+
+
+def make_repository(folder):
+    os.makedirs(os.path.join(folder, 'benchapp'))
+    with open(os.path.join(folder, 'setup.py'), 'w') as fp:
+        fp.write(setup_py)
+    with open(os.path.join(folder, 'app.ini'), 'w') as fp:
+        fp.write('[app:main]\nuse = egg:benchapp\n')
+    for i in range(50):
+        with open(os.path.join(folder, 'benchapp', 'mod%d.py' % i),
+                  'w') as fp:
+            fp.write('VALUE = %d\n' % i)
+    with open(os.path.join(folder, 'benchapp', '__init__.py'), 'w') as fp:
+        fp.write('')
+    hg('init', cwd=folder)
+    hg('commit', '--addremove', '-m', 'initial', '-u', 'bench', cwd=folder)
+
+
+def commit_change(folder):
+    with open(os.path.join(folder, 'benchapp', 'mod0.py'), 'a') as fp:
+        fp.write('CHANGED = %r\n' % time.time())
+    hg('commit', '-m', 'change', '-u', 'bench', cwd=folder)
+
+
+class Environment:
+    """
+    Root folder with *apps* apps, each with *applings* applings, half of
+    which are running.
+    """
+
+    def __init__(self, tmpdir, repository, apps, applings):
+        self.folder = tempfile.mkdtemp(dir=tmpdir)
+        logdir = os.path.join(self.folder, 'logs')
+        root = os.path.join(self.folder, 'root')
+        os.makedirs(logdir)
+        os.makedirs(root)
+        conf = {'rootdir': root, 'start_timeout': '5'}
+        for i in range(apps):
+            conf['app%d.hg' % i] = repository
+            conf['app%d.ini' % i] = 'app.ini'
+        self.uwsgi = stub_uwsgi.ConfiguredUwsgiModule(logdir)
+        self.deploy = score.deploy.init(conf, self.uwsgi)
+        self.ctx = types.SimpleNamespace(deploy=self.deploy)
+        self.names = []
+        for name, app in sorted(self.deploy.apps.items()):
+            os.makedirs(app.folder)
+            app.pull()
+            for j in range(applings):
+                ling = 'ling-%d' % j
+                hg('clone', '--quiet', app.mirror, ling, cwd=app.folder)
+                zergling = self.uwsgi.Zergling(
+                    app.overlord, ling, os.path.join(app.folder, ling,
+                                                     'app.ini'))
+                if j % 2 == 0:
+                    zergling.start()
+                self.names.append((name, ling))
+
+    def destroy(self):
+        shutil.rmtree(self.folder)
+
+
+def measure(func, repeat=1):
+    """
+    Returns the best duration of *repeat* calls to *func*.
+    """
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return best
+
+
+def bench_size(results, tmpdir, repository, apps, applings):
+    key = '%dx%d' % (apps, applings)
+    env = Environment(tmpdir, repository, apps, applings)
+    deploy = env.deploy
+    try:
+        def record(name, duration):
+            results.setdefault(name, {})[key] = duration
+            print('%-20s %-8s %9.4fs' % (name, key, duration))
+
+        cachefile = os.path.join(deploy.statedir, 'status.json')
+        record('status.uncached', measure(
+            lambda: collect_status(deploy.apps), repeat=3))
+        collect_status(deploy.apps, cache=StatusCache(cachefile))
+        record('status.cached', measure(
+            lambda: collect_status(deploy.apps, cache=StatusCache(cachefile)),
+            repeat=3))
+
+        def resolve_all():
+            for app, ling in env.names:
+                get_appling(env.ctx, '%s/%s' % (app, ling))
+        record('get_appling.cold', measure(resolve_all))
+        record('get_appling.warm', measure(resolve_all, repeat=3))
+
+        commit_change(repository)
+        record('update', measure(lambda: [
+            app.appling('ling-0').update()
+            for app in deploy.apps.values()]))
+        if applings < 2:
+            # starting needs a stopped appling besides the running ling-0
+            return
+        record('start', measure(lambda: [
+            app.appling('ling-1').start(pause_others=True)
+            for app in deploy.apps.values()]))
+
+        for app in deploy.apps.values():
+            for zergling in app.zerglings():
+                if zergling.name != 'ling-1':
+                    try:
+                        zergling.stop()
+                    except stub_uwsgi.NotRunning:
+                        pass
+            app.invalidate()
+        record('cleanup', measure(lambda: [
+            app.cleanup() for app in deploy.apps.values()]))
+    finally:
+        env.destroy()
+
+
+def bench_mkling(results, tmpdir, repository, count):
+    env = Environment(tmpdir, repository, 1, 0)
+    try:
+        app = env.deploy.apps['app0']
+        durations = []
+        for i in range(count):
+            durations.append(measure(
+                lambda: app.mkling('bench-%d' % i)))
+        results['mkling.first'] = {'1': durations[0]}
+        results['mkling.next'] = {'%d' % (count - 1): min(durations[1:])}
+        print('%-20s %-8s %9.4fs' % ('mkling.first', '1', durations[0]))
+        print('%-20s %-8s %9.4fs' % ('mkling.next', count - 1,
+                                     min(durations[1:])))
+    finally:
+        env.destroy()
+
+
+def bench_startup(results, conf, alias, count):
+    """
+    Measures the wall clock time of a ``deploy log`` invocation in a fresh
+    interpreter. The first run populates the configuration cache.
+    """
+    command = [sys.executable, '-c',
+               'from score.deploy.cli import main; main()',
+               '--local', conf, 'log', '-n', '1', alias]
+
+    def run():
+        subprocess.check_call(command, stdout=subprocess.DEVNULL)
+    cold = measure(run)
+    warm = measure(run, count)
+    results['startup.cold'] = {'1': cold}
+    results['startup.warm'] = {'%d' % count: warm}
+    print('%-20s %-8s %9.4fs' % ('startup.cold', '1', cold))
+    print('%-20s %-8s %9.4fs' % ('startup.warm', count, warm))
+
+
+def compare(results, baseline):
+    print()
+    print('%-20s %-8s %10s %10s %8s' %
+          ('benchmark', 'size', 'before', 'after', 'ratio'))
+    for name in sorted(results):
+        for size, after in sorted(results[name].items()):
+            before = baseline.get(name, {}).get(size)
+            if before is None:
+                continue
+            print('%-20s %-8s %9.4fs %9.4fs %7.2fx' %
+                  (name, size, before, after, after / before))
+
+
+def run_suite(results, args):
+    tmpdir = tempfile.mkdtemp(prefix='score-deploy-bench-')
+    try:
+        repository = os.path.join(tmpdir, 'repository')
+        make_repository(repository)
+        for size in args.sizes.split(','):
+            apps, applings = (int(value) for value in size.split('x'))
+            bench_size(results, tmpdir, repository, apps, applings)
+        if args.mkling > 1:
+            bench_mkling(results, tmpdir, repository, args.mkling)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-s', '--sizes', default='1x1,1x10,10x10,10x30',
+                        help='comma-separated list of APPSxAPPLINGS')
+    parser.add_argument('-m', '--mkling', type=int, default=3,
+                        help='number of applings to create with mkling, '
+                             'values below 2 skip this benchmark')
+    parser.add_argument('-o', '--output', default='bench.json',
+                        help='file to write the results to')
+    parser.add_argument('-c', '--compare', default=None,
+                        help='results of a previous run to compare with')
+    parser.add_argument('--startup', nargs=2, metavar=('CONF', 'ALIAS'),
+                        default=None,
+                        help='only measure the startup time of the command '
+                             'line interface with a real configuration')
+    args = parser.parse_args()
+    results = {}
+    if args.startup:
+        bench_startup(results, args.startup[0], args.startup[1], 5)
+    else:
+        run_suite(results, args)
+    with open(args.output, 'w') as fp:
+        json.dump({
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.time(),
+            'results': results,
+        }, fp, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as fp:
+            compare(results, json.load(fp)['results'])
+
+
+if __name__ == '__main__':
+    main()
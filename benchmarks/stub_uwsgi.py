@@ -0,0 +1,162 @@
+# Copyright © 2015 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+"""
+In-memory stand-in for :mod:`score.uwsgi`, which allows benchmarking the
+deployment operations without running any uWSGI processes. Call
+:func:`install` before importing :mod:`score.deploy`.
+"""
+
+import os
+import sys
+
+
+class NotRunning(Exception):
+    pass
+
+
+class AlreadyPaused(Exception):
+    pass
+
+
+class NoSuchZergling(Exception):
+    pass
+
+
+class Zergling:
+
+    def __init__(self, overlord, name, paste_ini=None):
+        self.overlord = overlord
+        self.name = name
+        self.paste_ini = paste_ini
+        self.logfile = os.path.join(overlord.logdir, '%s.log' % name)
+        self.state = 'stopped'
+        overlord._zerglings[name] = self
+
+    def is_running(self):
+        return self.state in ('running', 'paused')
+
+    def is_starting(self):
+        return False
+
+    def is_reloading(self):
+        return False
+
+    def is_paused(self):
+        return self.read_stats()['workers'][0]['status'] == 'pause'
+
+    def read_stats(self):
+        if self.state == 'stopped':
+            raise NotRunning()
+        status = 'pause' if self.state == 'paused' else 'idle'
+        return {'pid': None, 'workers': [{'status': status, 'requests': 0}]}
+
+    def regenini(self, virtualenv=None):
+        self.virtualenv = virtualenv
+
+    def start(self, quiet=False):
+        if self.state != 'stopped':
+            raise Exception('Already running')
+        with open(self.logfile, 'a') as fp:
+            fp.write('*** Starting zergling %s ***\n' % self.name)
+        self.state = 'running'
+
+    def stop(self):
+        if self.state == 'stopped':
+            raise NotRunning()
+        self.state = 'stopped'
+
+    def pause(self):
+        if self.state == 'stopped':
+            raise NotRunning()
+        if self.state == 'paused':
+            raise AlreadyPaused()
+        self.state = 'paused'
+
+    def resume(self):
+        if self.state == 'stopped':
+            raise NotRunning()
+        self.state = 'running'
+
+    def reload(self):
+        if self.state == 'stopped':
+            raise NotRunning()
+
+    def delete(self):
+        self.overlord._zerglings.pop(self.name, None)
+
+
+class Overlord:
+
+    def __init__(self, name, logdir):
+        self.name = name
+        self.logdir = logdir
+        self.running = False
+        self._zerglings = {}
+
+    def zerglings(self):
+        return list(self._zerglings.values())
+
+    def zergling(self, name):
+        if name not in self._zerglings:
+            raise NoSuchZergling(name)
+        return self._zerglings[name]
+
+    def regenini(self):
+        pass
+
+    def start(self):
+        self.running = True
+
+    def stop(self):
+        if not self.running:
+            raise NotRunning()
+        self.running = False
+
+
+class ConfiguredUwsgiModule:
+    """
+    Replacement for the configured uwsgi module, which is passed to
+    :func:`score.deploy.init`.
+    """
+
+    Zergling = Zergling
+
+    def __init__(self, logdir):
+        self.logdir = logdir
+        self._overlords = {}
+
+    def Overlord(self, name):
+        if name not in self._overlords:
+            self._overlords[name] = Overlord(name, self.logdir)
+        return self._overlords[name]
+
+
+def install():
+    """
+    Registers this module as :mod:`score.uwsgi`.
+    """
+    sys.modules['score.uwsgi'] = sys.modules[__name__]
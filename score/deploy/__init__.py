@@ -25,6 +25,13 @@
 # Licensee has his registered seat, an establishment or assets.
 
 
-from ._init import init, ConfiguredDeployModule
-
 __all__ = ['init', 'ConfiguredDeployModule']
+
+
+def __getattr__(name):
+    # the configured module is loaded on first access, so the command line
+    # interface does not pull in score.init and all its dependencies
+    if name in __all__:
+        from . import _init
+        return getattr(_init, name)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
@@ -25,81 +25,144 @@
 # Licensee has his registered seat, an establishment or assets.
 
 
-from score.uwsgi import NotRunning, AlreadyPaused
-import random
+import asyncio
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import fcntl
+import json
 import os
 import logging
 import shutil
 import sys
+import tempfile
+import threading
 import time
-from subprocess import Popen, check_call
+from subprocess import Popen, PIPE
+
+from . import _async, _vcs
+from ._log import LogIndex
+from ._names import mkname
+from ._timing import timed
+from ._trash import expired
+from ._venv import (
+    _break_links, clone_tree, fingerprint, manifest_files,
+    read_fingerprint, relocate, write_fingerprint)
 
 
 log = logging.getLogger(__name__)
 
 
-phonetics = {
-    "a": "alfa",
-    "b": "bravo",
-    "c": "charlie",
-    "d": "delta",
-    "e": "echo",
-    "f": "foxtrot",
-    "g": "golf",
-    "h": "hotel",
-    "i": "india",
-    "j": "juliett",
-    "k": "kilo",
-    "l": "lima",
-    "m": "mike",
-    "n": "november",
-    "o": "oscar",
-    "p": "papa",
-    "q": "quebec",
-    "r": "romeo",
-    "s": "sierra",
-    "t": "tango",
-    "u": "uniform",
-    "v": "victor",
-    "w": "whiskey",
-    "x": "xray",
-    "y": "yankee",
-    "z": "zulu",
-    "0": "zero",
-    "1": "wun",
-    "2": "too",
-    "3": "tree",
-    "4": "fower",
-    "5": "five",
-    "6": "six",
-    "7": "seven",
-    "8": "ait",
-    "9": "niner",
-}
-
-
-def mkname():
-    words = list(phonetics.values())
-    return '%s-%s' % (random.choice(words), random.choice(words))
-
-
-hg_reset = 'hg st --no-status --unknown --print0 --color false | ' \
-           'xargs -0 rm --force && ' \
-           'hg up --clean'
+# the next line used to read "venv.create(with_pip=True)", but that
+# not installing pip on our debian server.
+venv_create = "/bin/bash -c 'virtualenv --python=$(which python3) .venv'"
+
+# runs the python of the virtualenv directly: the activate script of a
+# virtualenv copied from another folder would activate the original
+venv_develop = ['.venv/bin/python', 'setup.py', 'develop']
+
+# compiles the working copy and the virtualenv with all cores, skipping files
+# whose bytecode is up to date
+venv_compile = ['.venv/bin/python', '-m', 'compileall', '-q', '-j', '0', '.']
 
 
 class NoSuchAppling(Exception):
     pass
 
 
+ZerglingState = namedtuple(
+    'ZerglingState', 'zergling running starting paused reloading')
+ZerglingState.__doc__ = """
+State of a zergling as collected by :meth:`App.snapshot`. The flag
+*starting* is only set for zerglings that are not *running*, the flag
+*paused* only for zerglings that are. *running* is `None` if the stats
+socket of the zergling did not answer in time.
+"""
+
+
+def _zergling_state(zergling):
+    """
+    Queries the :class:`ZerglingState` of a *zergling*, reading its stats
+    socket only once.
+    """
+    from score.uwsgi import NotRunning
+    reloading = zergling.is_reloading()
+    try:
+        stats = zergling.read_stats()
+    except NotRunning:
+        return ZerglingState(zergling, False, zergling.is_starting(), False,
+                             reloading)
+    workers = stats.get('workers', [])
+    paused = bool(workers) and workers[0].get('status') == 'pause'
+    return ZerglingState(zergling, True, False, paused, reloading)
+
+
+def _zergling_states(zerglings, timeout=None):
+    """
+    Queries the :class:`ZerglingState` of all *zerglings* concurrently and
+    returns them as a `dict` mapping zergling names to states. Zerglings not
+    answering within *timeout* seconds are reported with *running* set to
+    `None`. The queries run in daemon threads, as the threads of a
+    :class:`ThreadPoolExecutor` are joined on exit and would let a hung stats
+    socket block the process forever.
+    """
+    results = {}
+
+    def query(zergling):
+        try:
+            results[zergling.name] = (_zergling_state(zergling), None)
+        except Exception as e:
+            results[zergling.name] = (None, e)
+    threads = []
+    for zergling in zerglings:
+        thread = threading.Thread(target=query, args=(zergling,), daemon=True)
+        thread.start()
+        threads.append((zergling, thread))
+    deadline = None if timeout is None else time.monotonic() + timeout
+    states = {}
+    for zergling, thread in threads:
+        if deadline is None:
+            thread.join()
+        else:
+            thread.join(max(0, deadline - time.monotonic()))
+        if zergling.name not in results:
+            states[zergling.name] = ZerglingState(
+                zergling, None, False, False, False)
+            continue
+        state, error = results[zergling.name]
+        if error is not None:
+            raise error
+        states[zergling.name] = state
+    return states
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
 class App:
 
-    def __init__(self, name, repository, paste_ini):
+    def __init__(self, name, repository, paste_ini, spares=0, health=None,
+                 vcs=None, gc_limits=None):
         self.name = name
         self.repository = repository
+        if vcs is None:
+            vcs = _vcs.Mercurial()
+        self.vcs = vcs
         self.paste_ini = paste_ini
+        self.spares = spares
+        self.health = health
+        self.gc_limits = gc_limits
         self._folder = None
         self._overlord = None
+        self._snapshot = None
+        self._snapshot_time = 0
+        self._snapshot_lock = threading.Lock()
 
     @property
     def folder(self):
@@ -113,20 +176,101 @@ class App:
             self._overlord = self.conf.uwsgi.Overlord(self.name)
         return self._overlord
 
+    @property
+    def mirror(self):
+        """
+        Path to the local mirror of the app's repository. Applings are cloned
+        from and updated with this mirror, which is synchronized with the
+        remote repository in :meth:`pull`.
+        """
+        return os.path.join(self.conf.statedir, 'mirrors',
+                            self.name + self.vcs.mirror_suffix)
+
+    def pull(self):
+        """
+        Fetches new changesets from the remote repository into the local
+        mirror, creating the mirror if necessary.
+        """
+        _async.drive(self._pull_steps())
+
+    async def apull(self):
+        """
+        Awaitable variant of :meth:`pull`.
+        """
+        await _async.adrive(self._pull_steps())
+
+    @timed('pull')
+    def _pull_steps(self):
+        log.info('Pulling %s' % self.repository)
+        if os.path.isdir(self.mirror):
+            if (yield _async.Run(self.vcs.pull_mirror(self.repository),
+                                 cwd=self.mirror)):
+                raise Exception('Error pulling %s' % self.repository)
+            return
+        parent = os.path.dirname(self.mirror)
+        os.makedirs(parent, exist_ok=True)
+        tmpname = '%s.%d' % (self.name, os.getpid())
+        returncode = yield _async.Run(
+            self.vcs.clone_mirror(self.repository, tmpname), cwd=parent)
+        if returncode:
+            shutil.rmtree(os.path.join(parent, tmpname), ignore_errors=True)
+            raise Exception('Error cloning %s' % self.repository)
+        try:
+            os.rename(os.path.join(parent, tmpname), self.mirror)
+        except OSError:
+            # mirror was created by a concurrent process
+            shutil.rmtree(os.path.join(parent, tmpname))
+
+    def snapshot(self, timeout=None):
+        """
+        Returns the state of all zerglings of this app as a `dict` mapping
+        zergling names to :class:`ZerglingState` tuples. The states are
+        queried concurrently, reading the stats socket of each zergling once,
+        and served from memory for the configured ``state_ttl`` or until
+        :meth:`invalidate` is called.
+
+        If a *timeout* is given, zerglings not answering within as many
+        seconds are reported with *running* set to `None`. Snapshots
+        containing such states are not kept in memory.
+        """
+        with self._snapshot_lock:
+            if self._snapshot is None or \
+                    time.monotonic() - self._snapshot_time > \
+                    self.conf.state_ttl:
+                snapshot = _zergling_states(self.zerglings(), timeout)
+                if any(state.running is None
+                       for state in snapshot.values()):
+                    return snapshot
+                self._snapshot = snapshot
+                self._snapshot_time = time.monotonic()
+            return self._snapshot
+
+    def invalidate(self):
+        """
+        Discards the current :meth:`snapshot`. Must be called after changing
+        the state of a zergling.
+        """
+        with self._snapshot_lock:
+            self._snapshot = None
+
     def zerglings(self):
+        """
+        Lists the zerglings of this app as configured in the overlord's ini
+        file, without querying their state. See :meth:`snapshot` for that.
+        """
         return self.overlord.zerglings()
 
     def zergling(self, name):
         return self.overlord.zergling(name)
 
     def appling(self, name):
-        try:
-            self.zergling(name)
-        except NoSuchAppling:
-            raise KeyError(name)
+        if name not in (zergling.name for zergling in self.zerglings()):
+            raise NoSuchAppling(name)
         return AppLing(self, name)
 
+    @timed('init')
     def initialize(self):
+        from score.uwsgi import NotRunning
         try:
             os.makedirs(self.folder)
         except OSError as e:
@@ -136,26 +280,254 @@ class App:
             self.overlord.stop()
         except NotRunning:
             pass
+        self.invalidate()
         self.cleanup()
         self.overlord.regenini()
         self.overlord.start()
-
-    def mkling(self, name=None):
+        self.invalidate()
+
+    def mkling(self, name=None, *, source=None):
+        """
+        Creates a new appling called *name* (or a random name). If a *source*
+        :class:`AppLing` is given, the new appling is a copy of it at the
+        same revision and with the same virtualenv.
+        """
+        return _async.drive(self._mkling_steps(name, source))
+
+    async def amkling(self, name=None, *, source=None, timeout=None):
+        """
+        Awaitable variant of :meth:`mkling`, which gives up after *timeout*
+        seconds, if given.
+        """
+        return await asyncio.wait_for(
+            _async.adrive(self._mkling_steps(name, source)), timeout)
+
+    @timed('mkling')
+    def _mkling_steps(self, name, source):
         if not name:
             name = mkname()
+        if source is not None and source.app is not self:
+            raise Exception('Cannot create an appling of %s from %s' %
+                            (self.name, source))
         log.info('Creating %s/%s' % (self.name, name))
         appling = AppLing(self, name)
-        appling.initialize()
+        yield from appling._initialize_steps(source)
+        revision = yield _async.Call(_vcs.working_revision, appling.folder)
+        yield _async.Call(self.conf.registry.set, self.name, name,
+                          folder=appling.folder, revision=revision,
+                          state='stopped')
+        if self.spares:
+            self.replenish(background=True)
         return appling
 
+    def spare_folders(self):
+        """
+        Returns the paths of all ready-to-use spare folders of this app.
+        """
+        if not os.path.isdir(self.folder):
+            return []
+        return sorted(os.path.join(self.folder, folder_name)
+                      for folder_name in os.listdir(self.folder)
+                      if folder_name.startswith('_spare_'))
+
+    def replenish(self, *, background=False):
+        """
+        Builds spare folders until there are as many as configured. Spare
+        folders contain a checkout of the repository with a ready virtualenv
+        and compiled bytecode, which can be moved into place by
+        :meth:`AppLing.initialize`.
+
+        If *background* is `True`, the spares are built in a detached process
+        and this function returns immediately. Its output is appended to the
+        file ``<app>.spares.log`` in the state folder.
+        """
+        if not os.path.isdir(self.folder):
+            raise Exception('App %s is not initialized' % self.name)
+        if background:
+            self._replenish_detached()
+            return
+        lockfile = os.path.join(self.conf.statedir, '%s.spares' % self.name)
+        with open(lockfile, 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # another process is already replenishing
+                return
+            while len(self.spare_folders()) < self.spares:
+                self._build_spare()
+
+    def _replenish_detached(self):
+        # forking this (possibly multi-threaded) process could deadlock the
+        # child on locks held by other threads, so start a new interpreter
+        if self.conf.confdict is None:
+            raise Exception('Cannot replenish spares of %s in the background '
+                            'without the configuration' % self.name)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(path for path in sys.path if path)
+        logfile = os.path.join(self.conf.statedir, '%s.spares.log' % self.name)
+        with open(logfile, 'ab') as output:
+            proc = Popen([sys.executable, '-m', 'score.deploy._replenish'],
+                         stdin=PIPE, stdout=output, stderr=output, env=env,
+                         start_new_session=True)
+        proc.stdin.write(json.dumps({
+            'conf': self.conf.confdict,
+            'app': self.name,
+        }).encode('utf-8'))
+        proc.stdin.close()
+
+    @timed('spare-build')
+    def _build_spare(self):
+        spare = AppLing(self, '_building_%d' % os.getpid())
+        log.info('Building spare folder for %s' % self.name)
+        if os.path.exists(spare.folder):
+            self.conf.trash.put(spare.folder)
+        _async.drive(spare._folder_steps())
+        _async.drive(spare._venv_steps())
+        _async.drive(spare._compile_steps())
+        suffix = 0
+        while True:
+            newname = '_spare_%d' % suffix
+            try:
+                os.rename(spare.folder, os.path.join(self.folder, newname))
+                break
+            except OSError:
+                suffix += 1
+
+    def recycled_folders(self):
+        """
+        Returns the paths of all recycled folders, ordered by how cheaply they
+        can be brought to the tip of the mirror: folders with a virtualenv
+        matching the dependencies at the tip come first, followed by the
+        others, each ordered by their distance to the tip.
+        """
+        candidates = {}
+        for folder_name in os.listdir(self.folder):
+            if not folder_name.startswith('_unused_'):
+                continue
+            folder = os.path.join(self.folder, folder_name)
+            if not os.path.isdir(folder):
+                continue
+            candidates[folder] = (
+                _vcs.working_revision(folder),
+                read_fingerprint(os.path.join(folder, '.venv')))
+        if len(candidates) < 2:
+            return list(candidates)
+        distances = self.vcs.distances(
+            self.mirror, (node for node, fp in candidates.values() if node))
+        target = self._tip_fingerprint()
+
+        def cost(folder):
+            node, fp = candidates[folder]
+            distance = distances.get(node, float('inf'))
+            return (fp is None or fp != target, distance, folder)
+        return sorted(candidates, key=cost)
+
+    def _tip_fingerprint(self):
+        """
+        Returns the virtualenv fingerprint of the dependencies at the tip of
+        the mirror.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.vcs.extract(self.mirror, tmpdir)
+            return fingerprint(manifest_files(tmpdir))
+
+    @timed('rollout')
+    def update(self, names=None, *, jobs=4, batch_size=1, timeout=None,
+               callback=None):
+        """
+        Updates the applings with given *names* (or all applings, if *names*
+        is `None`) to the newest changeset of the remote repository.
+
+        The repository is pulled only once, the applings are updated with at
+        most *jobs* concurrent operations. Running zerglings are reloaded
+        afterwards in batches of *batch_size*, waiting at most *timeout*
+        seconds for each batch to come up before proceeding with the next
+        one. The rollout is aborted if a zergling fails to come up.
+
+        The optional *callback* is invoked with each appling and the
+        exception its update or reload raised (or `None`). Running applings,
+        that were updated but not reloaded because the rollout was aborted,
+        are reported with an exception as well. Returns a `dict` mapping the
+        names of the failed and skipped applings to their exceptions.
+        """
+        applings = []
+        snapshot = self.snapshot()
+        for name in sorted(snapshot):
+            if names is not None and name not in names:
+                continue
+            appling = AppLing(self, name)
+            appling._zergling = snapshot[name].zergling
+            applings.append(appling)
+        self.pull()
+        errors = {}
+
+        def report(appling, error):
+            if error is not None:
+                errors[appling.name] = error
+            if callback:
+                callback(appling, error)
+
+        def update(appling):
+            try:
+                appling.update(pull=False)
+            except Exception as e:
+                return e
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            for appling, error in zip(applings, pool.map(update, applings)):
+                if error is not None:
+                    report(appling, error)
+        running = [appling for appling in applings
+                   if appling.name not in errors and
+                   snapshot[appling.name].running]
+        if timeout is None:
+            timeout = self.conf.start_timeout
+        batch_size = max(1, batch_size)
+        skipped = []
+        for i in range(0, len(running), batch_size):
+            batch = running[i:i + batch_size]
+            for appling in batch:
+                log.info('Reloading %s' % appling)
+                appling.zergling.reload()
+            self.invalidate()
+            failed = False
+            for appling in batch:
+                try:
+                    appling.wait(timeout)
+                except Exception as e:
+                    failed = True
+                    report(appling, e)
+                else:
+                    report(appling, None)
+            if failed:
+                log.error('Aborting rolling reload of %s' % self.name)
+                skipped = running[i + batch_size:]
+                break
+        for appling in skipped:
+            report(appling, Exception(
+                'Updated, but not reloaded after aborting the rollout'))
+        for appling in applings:
+            if appling.name not in errors and appling not in running:
+                report(appling, None)
+        return errors
+
+    @timed('cleanup')
     def cleanup(self):
+        """
+        Deletes the zerglings that are neither running nor starting and
+        recycles their folders for future applings. Recycled folders
+        exceeding the configured limits and all other unknown files and
+        folders are moved to the :class:`Trash`.
+        """
         suffix = 0
         running_zerglings = []
-        for zergling in self.overlord.zerglings():
-            if zergling.is_running() or zergling.is_starting():
+        trash = self.conf.trash
+        for state in list(self.snapshot().values()):
+            zergling = state.zergling
+            if state.running or state.starting:
                 running_zerglings.append(zergling.name)
                 continue
             zergling.delete()
+            self.invalidate()
             folder = os.path.join(self.folder, zergling.name)
             if not os.path.isdir(folder):
                 continue
@@ -166,20 +538,54 @@ class App:
                     break
                 except OSError:
                     suffix += 1
+            # the modification time marks the time of recycling
+            os.utime(os.path.join(self.folder, newname))
         for folder_name in os.listdir(self.folder):
             folder = os.path.join(self.folder, folder_name)
             if not os.path.isdir(folder):
                 # not a folder -> delete
-                shutil.rmtree(folder)
+                trash.put(folder, reap=False)
                 continue
             if folder_name.startswith('_unused_'):
                 # recycled folder -> keep
                 continue
+            if folder_name.startswith('_spare_'):
+                # spare folder -> keep
+                continue
+            if folder_name.startswith('_building_') and \
+                    folder_name[10:].isdigit() and \
+                    _is_alive(int(folder_name[10:])):
+                # spare folder currently being built -> keep
+                continue
             if folder_name in running_zerglings:
                 # running process -> keep
                 continue
             # none of the above -> delete
-            shutil.rmtree(folder)
+            trash.put(folder, reap=False)
+        for folder in self._evict_recycled():
+            trash.put(folder, reap=False)
+        trash.reap()
+        self.conf.registry.replace(self.name, dict(
+            (name, {'folder': os.path.join(self.folder, name),
+                    'state': 'running'})
+            for name in running_zerglings))
+
+    async def acleanup(self):
+        """
+        Awaitable variant of :meth:`cleanup`.
+        """
+        await _async.call(self.cleanup)
+
+    def _evict_recycled(self):
+        """
+        Returns the recycled folders exceeding the configured limits on their
+        number, age and total disk usage, preferring to keep the most
+        recently recycled ones.
+        """
+        return expired([os.path.join(self.folder, folder_name)
+                        for folder_name in os.listdir(self.folder)
+                        if folder_name.startswith('_unused_')],
+                       self.conf.recycle_limits)
 
 
 class AppLing:
@@ -196,110 +602,387 @@ class AppLing:
             self._zergling = self.app.overlord.zergling(self.name)
         return self._zergling
 
-    def update(self):
+    def update(self, *, pull=True):
+        """
+        Updates the working copy to the newest changeset of the app's mirror.
+        The mirror itself is pulled first, unless *pull* is `False`.
+        """
+        _async.drive(self._update_steps(pull))
+
+    async def aupdate(self, *, pull=True, timeout=None):
+        """
+        Awaitable variant of :meth:`update`, which gives up after *timeout*
+        seconds, if given. Cancelling it kills the running VCS process.
+        """
+        await asyncio.wait_for(
+            _async.adrive(self._update_steps(pull)), timeout)
+
+    @timed('update')
+    def _update_steps(self, pull):
         log.info('Updating %s' % self)
-        stdout = sys.stdout
-        proc = Popen(['hg', 'pull', self.app.repository],
-                     cwd=self.folder, stdout=stdout, stderr=sys.stderr)
-        out, err = proc.communicate()
-        if proc.returncode:
+        if pull:
+            yield from self.app._pull_steps()
+        vcs = self.app.vcs
+        if (yield _async.Run(vcs.fetch(self.app.mirror), cwd=self.folder)):
             raise Exception('Error pulling %s' % self)
-        proc = Popen(['hg', 'update', '--clean'],
-                     cwd=self.folder, stdout=stdout, stderr=sys.stderr)
-        out, err = proc.communicate()
-        if proc.returncode:
+        if (yield _async.Run(vcs.update(), cwd=self.folder)):
             raise Exception('Error updating %s' % self)
-
-    def start(self, *, pause_others=False):
+        yield from self._compile_steps()
+
+    def start(self, *, pause_others=False, timeout=None):
+        """
+        Starts or resumes the zergling and waits until it is up. Returns the
+        number of seconds the startup took.
+
+        The zergling must be running within *timeout* seconds, which defaults
+        to the configured ``start_timeout``. If *pause_others* is `True`, all
+        other zerglings of the app are paused afterwards. If the app has a
+        :class:`HealthCheck`, it must pass before the others are paused.
+        Otherwise this zergling is stopped (or paused again, if it was
+        paused before) and the others keep serving.
+        """
+        return _async.drive(self._start_steps(pause_others, timeout))
+
+    async def astart(self, *, pause_others=False, timeout=None):
+        """
+        Awaitable variant of :meth:`start`.
+        """
+        return await _async.adrive(self._start_steps(pause_others, timeout))
+
+    @timed('start')
+    def _start_steps(self, pause_others, timeout):
         log.info('Starting %s' % self)
+        if timeout is None:
+            timeout = self.app.conf.start_timeout
+        resumed = yield _async.Call(self._launch)
+        elapsed = yield from self._wait_steps(timeout)
+        log.info('Started %s in %.2fs' % (self, elapsed))
+        yield _async.Call(self._cutover, pause_others, resumed)
+        return elapsed
+
+    def _launch(self):
+        """
+        Resumes or starts the zergling and returns whether it was resumed.
+        """
+        from score.uwsgi import NotRunning
         try:
             self.zergling.resume()
+            resumed = True
         except NotRunning:
-            venvpath = os.path.join(self.folder, '.venv')
-            self.zergling.regenini(virtualenv=venvpath)
+            resumed = False
+            self._regenini()
             self.zergling.start(quiet=True)
-        while self.zergling.is_starting():
-            time.sleep(0.1)
+        self.app.invalidate()
+        return resumed
+
+    def _cutover(self, pause_others, resumed):
+        from score.uwsgi import NotRunning, AlreadyPaused
+        if pause_others and self.app.health:
+            try:
+                with self.app.conf.journal.span(
+                        'health', self.app.name, self.name):
+                    self.app.health.check(self)
+            except Exception:
+                log.error('Rolling back %s' % self)
+                try:
+                    if resumed:
+                        self.zergling.pause()
+                    else:
+                        self.zergling.stop()
+                except (NotRunning, AlreadyPaused):
+                    pass
+                self.app.invalidate()
+                raise
+        # recorded only after passing the health check, as the zergling is
+        # stopped (or paused) again on rollback
+        self.app.conf.registry.set(self.app.name, self.name,
+                                   folder=self.folder, state='running')
         if not pause_others:
             return
-        for i in range(3):
-            if self.zergling.is_running():
-                break
-            time.sleep(0.1)
-        if not self.zergling.is_running():
-            raise Exception('Instance did not start')
-        for zergling in self.app.zerglings():
-            if zergling.name == self.name:
+        for name, state in self.app.snapshot().items():
+            if name == self.name or not state.running:
                 continue
             try:
-                zergling.pause()
+                state.zergling.pause()
             except (NotRunning, AlreadyPaused):
                 pass
-
+            else:
+                self.app.conf.registry.set(
+                    self.app.name, name, state='paused')
+        self.app.invalidate()
+
+    def wait(self, timeout):
+        """
+        Waits until the zergling has finished starting and is running. Raises
+        an exception if that takes longer than *timeout* seconds, returns the
+        number of seconds spent waiting otherwise.
+        """
+        return _async.drive(self._wait_steps(timeout))
+
+    async def await_ready(self, timeout):
+        """
+        Awaitable variant of :meth:`wait`.
+        """
+        return await _async.adrive(self._wait_steps(timeout))
+
+    @timed('wait')
+    def _wait_steps(self, timeout):
+        watch = [os.path.dirname(self.zergling.logfile)]
+        try:
+            elapsed = yield _async.Wait(
+                lambda: not self.zergling.is_starting(), timeout, watch=watch)
+            # the zergling might need a moment to report that it is running
+            # after it stopped reporting that it is starting
+            elapsed += yield _async.Wait(
+                self.zergling.is_running, min(1, max(0.1, timeout - elapsed)),
+                watch=watch)
+        except TimeoutError:
+            raise Exception('Instance did not start within %ss' % timeout)
+        return elapsed
+
+    @timed('stop')
     def stop(self):
+        from score.uwsgi import NotRunning
         log.info('Stopping %s' % self)
         try:
             self.zergling.stop()
         except NotRunning:
             pass
+        self.app.invalidate()
+        self.app.conf.registry.set(self.app.name, self.name,
+                                   folder=self.folder, state='stopped')
+
+    async def astop(self, *, timeout=None):
+        """
+        Awaitable variant of :meth:`stop`.
+        """
+        await asyncio.wait_for(_async.call(self.stop), timeout)
 
     def __str__(self):
         return '<AppLing %s/%s>' % (self.app.name, self.name)
 
-    def initialize(self):
+    @property
+    def logindex(self):
+        """
+        :class:`LogIndex` of this appling's log file.
+        """
+        indexfile = os.path.join(self.app.conf.statedir, 'logindex',
+                                 self.app.name, '%s.json' % self.name)
+        return LogIndex(self.zergling.logfile, indexfile)
+
+    def initialize(self, *, source=None):
+        """
+        Creates the folder and the zergling of this appling. The folder is
+        copied from the appling *source*, if given, or taken from a spare or
+        a recycled folder, or cloned from the mirror.
+        """
+        _async.drive(self._initialize_steps(source))
+
+    async def ainitialize(self, *, source=None):
+        """
+        Awaitable variant of :meth:`initialize`.
+        """
+        await _async.adrive(self._initialize_steps(source))
+
+    @timed('initialize')
+    def _initialize_steps(self, source):
         uwsgi = self.app.conf.uwsgi
         self._zergling = uwsgi.Zergling(
             self.app.overlord, self.name,
             os.path.join(self.folder, self.app.paste_ini))
-        self._init_folder()
-        self._init_venv()
+        if source is not None:
+            yield _async.Call(self._init_from_appling, source)
+            yield from self._compile_steps()
+        elif (yield _async.Call(self._init_from_spare)):
+            yield from self._refresh_spare_steps()
+        else:
+            yield from self._folder_steps()
+            yield from self._venv_steps()
+            yield from self._compile_steps()
+        yield _async.Call(self._init_zergling)
+
+    @property
+    def health_socket(self):
+        """
+        Path to the unix socket, on which the zergling answers HTTP requests
+        directly, if its app has a :class:`HealthCheck`.
+        """
+        return os.path.join(os.path.dirname(self.zergling.logfile),
+                            'zergling-%s.http.sock' % self.name)
+
+    def _regenini(self):
+        """
+        Regenerates the zergling's section in the overlord's ini file. If
+        the app has a health check, the zergling gets a private HTTP socket
+        in addition to its connection to the overlord's zerg pool, so the
+        check reaches this zergling and none of the others.
+        """
+        self.zergling.regenini(virtualenv=os.path.join(self.folder, '.venv'))
+        if not self.app.health:
+            return
+        from score.uwsgi.iniparser import UwsgiIni
+        ini = UwsgiIni()
+        with open(self.zergling.inifile) as fp:
+            ini.load(fp)
+        section = ini['zergling-%s' % self.name]
+        if self.health_socket not in section.get_all('http-socket'):
+            section['http-socket'] = self.health_socket
+        with open(self.zergling.inifile, 'w') as fp:
+            ini.write(fp)
+
+    def _init_zergling(self):
+        with self.app.conf.journal.span('regenini', self.app.name, self.name):
+            self._regenini()
         logpath = os.path.join(self.folder, 'zergling.log')
         try:
             os.unlink(logpath)
         except OSError:
             pass
         os.symlink(self.zergling.logfile, logpath)
+        self.app.invalidate()
 
-    def _init_venv(self):
-        venvpath = os.path.join(self.folder, '.venv')
+    @timed('venv')
+    def _venv_steps(self):
+        venvpath, key, cached = yield _async.Call(self._prepare_venv)
+        journal = self.app.conf.journal
         if not os.path.exists(venvpath):
-            # the next line used to read "venv.create(with_pip=True)", but that
-            # not installing pip on our debian server.
-            check_call(
-                "/bin/bash -c 'virtualenv --python=$(which python3) .venv'",
-                shell=True, cwd=self.folder,
-                stdout=sys.stdout, stderr=sys.stderr)
-        proc = Popen(
-            "/bin/bash -c 'source .venv/bin/activate && python setup.py develop'",
-            shell=True, cwd=self.folder, stdout=sys.stdout, stderr=sys.stderr)
-        out, err = proc.communicate()
-        if proc.returncode:
+            with journal.span('virtualenv', self.app.name, self.name):
+                if (yield _async.Run([venv_create], cwd=self.folder)):
+                    raise Exception('Error creating virtualenv of %s' % self)
+        with journal.span('develop', self.app.name, self.name):
+            returncode = yield _async.Run([venv_develop], cwd=self.folder)
+        if returncode:
             raise Exception('Error installing %s' % self)
-        self.zergling.regenini(virtualenv=venvpath)
+        yield _async.Call(self._finish_venv, venvpath, key, cached)
 
-    def _init_folder(self):
-        for folder_name in os.listdir(self.app.folder):
-            folder = os.path.join(self.app.folder, folder_name)
-            if not os.path.isdir(folder):
+    def _prepare_venv(self):
+        """
+        Provides the virtualenv from the cache, if possible. Returns its path,
+        its fingerprint and whether it was taken from the cache.
+        """
+        venvpath = os.path.join(self.folder, '.venv')
+        venvs = self.app.conf.venvs
+        key = fingerprint(manifest_files(self.folder))
+        cached = False
+        if os.path.exists(venvpath) and read_fingerprint(venvpath) != key:
+            # recycled folder with different dependencies
+            if venvs.get(key, venvpath + '.new'):
+                self.app.conf.trash.put(venvpath)
+                os.rename(venvpath + '.new', venvpath)
+                cached = True
+        elif not os.path.exists(venvpath):
+            cached = venvs.get(key, venvpath)
+        return venvpath, key, cached
+
+    def _finish_venv(self, venvpath, key, cached):
+        write_fingerprint(venvpath, key)
+        if not cached:
+            self.app.conf.venvs.put(key, venvpath)
+
+    @timed('compile')
+    def _compile_steps(self):
+        """
+        Compiles the bytecode of all changed files in the folder, including
+        the virtualenv, so the workers neither need to compile it on their
+        first requests nor race each other writing it.
+        """
+        if not os.path.exists(
+                os.path.join(self.folder, '.venv', 'bin', 'python')):
+            log.warn('No virtualenv to compile bytecode of %s' % self)
+            return
+        if (yield _async.Run([venv_compile], cwd=self.folder)):
+            log.warn('Error compiling bytecode of %s' % self)
+
+    @timed('fork')
+    def _init_from_appling(self, source):
+        """
+        Copies the folder of the appling *source*, including its working copy
+        and virtualenv, using copy-on-write or hard links, if possible. Files
+        that are modified in place are replaced with private copies and all
+        paths to the folder of *source* in the virtualenv, including those of
+        its editable install, are changed to point to the new folder.
+        """
+        if os.path.lexists(self.folder):
+            raise Exception('Folder of %s already exists' % self)
+        tmpfolder = os.path.join(self.app.folder, '_forking_%d' % os.getpid())
+        try:
+            method = clone_tree(source.folder, tmpfolder)
+            log.debug('Copied %s to %s (%s)' % (source, self, method))
+            os.rename(tmpfolder, self.folder)
+        except Exception:
+            if os.path.lexists(tmpfolder):
+                self.app.conf.trash.put(tmpfolder)
+            raise
+        venvpath = os.path.join(self.folder, '.venv')
+        if os.path.isdir(venvpath):
+            _break_links(venvpath)
+            relocate(venvpath)
+
+    @timed('spare-take')
+    def _init_from_spare(self):
+        for spare in self.app.spare_folders():
+            try:
+                os.rename(spare, self.folder)
+            except OSError:
+                # taken by a concurrent process
                 continue
-            if not folder_name.startswith('_unused_'):
+            relocate(os.path.join(self.folder, '.venv'))
+            return True
+        return False
+
+    @timed('spare-refresh')
+    def _refresh_spare_steps(self):
+        """
+        Brings a spare folder taken by :meth:`_init_from_spare`, which might
+        have been built from an older revision, to the tip of the freshly
+        pulled mirror. The virtualenv is rebuilt if the dependencies changed
+        in the meantime.
+        """
+        yield from self._update_steps(True)
+        venvpath = os.path.join(self.folder, '.venv')
+        if read_fingerprint(venvpath) != \
+                fingerprint(manifest_files(self.folder)):
+            yield from self._venv_steps()
+            yield from self._compile_steps()
+
+    @timed('folder')
+    def _folder_steps(self):
+        """
+        Provides the working copy in the folder of this appling, preferably
+        by resetting a recycled folder. Returns whether a recycled folder was
+        used.
+        """
+        yield from self.app._pull_steps()
+        recycled = yield _async.Call(self.app.recycled_folders)
+        for folder in recycled:
+            folder_name = os.path.basename(folder)
+            try:
+                os.rename(folder, self.folder)
+            except OSError:
+                # taken by a concurrent process
                 continue
-            os.rename(folder, self.folder)
-            proc = Popen(hg_reset, shell=True, cwd=self.folder,
-                         stdout=sys.stdout, stderr=sys.stderr)
-            out, err = proc.communicate()
-            if proc.returncode:
+            vcs = self.app.vcs
+            returncode = yield _async.Run(vcs.fetch(self.app.mirror),
+                                          cwd=self.folder)
+            if not returncode:
+                with self.app.conf.journal.span(
+                        'reset', self.app.name, self.name):
+                    returncode = yield _async.Run(vcs.reset(),
+                                                  cwd=self.folder)
+            if returncode:
                 log.warn('Error cleaning up folder %s. Deleting.' %
                          folder_name)
-                shutil.rmtree(self.folder)
+                self.app.conf.trash.put(self.folder)
                 continue
+            venvpath = os.path.join(self.folder, '.venv')
+            if os.path.isdir(venvpath):
+                yield _async.Call(relocate, venvpath)
             return True
-        self._clone()
+        yield from self._clone_steps()
         return False
 
-    def _clone(self):
-        proc = Popen(['hg', 'clone', self.app.repository, self.name],
-                     cwd=self.app.folder, stdout=sys.stdout, stderr=sys.stderr)
-        out, err = proc.communicate()
-        if proc.returncode:
+    @timed('clone')
+    def _clone_steps(self):
+        if (yield _async.Run(self.app.vcs.clone(self.app.mirror, self.name),
+                             cwd=self.app.folder)):
             raise Exception('Error cloning %s' % self)
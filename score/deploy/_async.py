@@ -0,0 +1,207 @@
+# Copyright © 2015 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+
+import asyncio
+import functools
+import sys
+import time
+
+from . import _vcs, _wait
+
+
+async def run(args, *, cwd, shell=False, stdout=None, stderr=None):
+    """
+    Runs the command *args* (a list, or a string if *shell* is `True`) in
+    the folder *cwd* and returns its exit code. The output is forwarded to
+    this process' stdout and stderr by default. The process is killed if
+    the calling task is cancelled.
+    """
+    if stdout is None:
+        stdout = sys.stdout
+    if stderr is None:
+        stderr = sys.stderr
+    if shell:
+        proc = await asyncio.create_subprocess_shell(
+            args, cwd=cwd, stdout=stdout, stderr=stderr)
+    else:
+        proc = await asyncio.create_subprocess_exec(
+            *args, cwd=cwd, stdout=stdout, stderr=stderr)
+    try:
+        return await proc.wait()
+    except asyncio.CancelledError:
+        proc.kill()
+        await proc.wait()
+        raise
+
+
+async def call(func, *args):
+    """
+    Calls the blocking *func* with given *args* in the default executor.
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, func, *args)
+
+
+async def wait_until(predicate, timeout, *, watch=()):
+    """
+    Asynchronous variant of :func:`score.deploy._wait.wait_until`: waits
+    until the blocking *predicate* returns a truthy value and returns the
+    number of seconds it took. Raises a :class:`TimeoutError` after
+    *timeout* seconds.
+
+    The predicate is tested again whenever one of the files or folders in
+    *watch* changes (if inotify is available), but at least with an
+    exponentially increasing interval of up to one second.
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    try:
+        inotify = _wait._Inotify(watch) if watch else None
+    except OSError:
+        inotify = None
+    changed = asyncio.Event()
+    loop = asyncio.get_event_loop()
+    if inotify:
+        loop.add_reader(inotify.fd, changed.set)
+    delay = 0.01
+    try:
+        while True:
+            changed.clear()
+            if await call(predicate):
+                return time.monotonic() - start
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError('Timed out after %ss' % timeout)
+            try:
+                await asyncio.wait_for(changed.wait(), min(delay, remaining))
+            except asyncio.TimeoutError:
+                pass
+            if inotify:
+                inotify.drain()
+            delay = min(delay * 2, 1)
+    finally:
+        if inotify:
+            loop.remove_reader(inotify.fd)
+            inotify.close()
+
+
+class Run:
+    """
+    Step running the *commands* in the folder *cwd* like
+    :func:`score.deploy._vcs.run`. Its result is the exit code of the first
+    command that fails, or 0.
+    """
+
+    def __init__(self, commands, *, cwd):
+        self.commands = commands
+        self.cwd = cwd
+
+    def run(self):
+        return _vcs.run(self.commands, cwd=self.cwd)
+
+    async def arun(self):
+        return await _vcs.arun(self.commands, cwd=self.cwd)
+
+
+class Call:
+    """
+    Step calling the blocking function *func* with given arguments. Its
+    result is the return value of the function.
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = functools.partial(func, *args, **kwargs)
+
+    def run(self):
+        return self.func()
+
+    async def arun(self):
+        return await call(self.func)
+
+
+class Wait:
+    """
+    Step waiting until the blocking *predicate* returns a truthy value, see
+    :func:`wait_until`. Its result is the number of seconds it took.
+    """
+
+    def __init__(self, predicate, timeout, *, watch=()):
+        self.predicate = predicate
+        self.timeout = timeout
+        self.watch = watch
+
+    def run(self):
+        return _wait.wait_until(self.predicate, self.timeout,
+                                watch=self.watch)
+
+    async def arun(self):
+        return await wait_until(self.predicate, self.timeout,
+                                watch=self.watch)
+
+
+def drive(steps):
+    """
+    Executes an operation written as a generator, which yields steps
+    (:class:`Run`, :class:`Call` or :class:`Wait` objects) and receives their
+    results. The steps are executed in the calling thread. Exceptions raised
+    by a step are thrown into the generator. Returns the return value of the
+    generator.
+    """
+    result = error = None
+    while True:
+        try:
+            if error is None:
+                step = steps.send(result)
+            else:
+                step = steps.throw(error)
+        except StopIteration as e:
+            return e.value
+        try:
+            result, error = step.run(), None
+        except BaseException as e:
+            result, error = None, e
+
+
+async def adrive(steps):
+    """
+    Awaitable variant of :func:`drive`, which executes blocking steps in the
+    default executor. Cancelling it cancels the current step and throws the
+    cancellation into the generator.
+    """
+    result = error = None
+    while True:
+        try:
+            if error is None:
+                step = steps.send(result)
+            else:
+                step = steps.throw(error)
+        except StopIteration as e:
+            return e.value
+        try:
+            result, error = await step.arun(), None
+        except BaseException as e:
+            result, error = None, e
@@ -0,0 +1,119 @@
+# Copyright © 2015 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+
+import hashlib
+import json
+import os
+
+
+def cache_file(conf):
+    """
+    Returns the path of the cache file for the configuration file *conf*.
+    """
+    folder = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    digest = hashlib.sha1(os.path.abspath(conf).encode('utf-8')).hexdigest()
+    return os.path.join(folder, 'score.deploy', '%s.json' % digest[:16])
+
+
+def _fingerprint(conf):
+    st = os.stat(conf)
+    with open(conf, 'rb') as fp:
+        digest = hashlib.sha256(fp.read()).hexdigest()
+    return st.st_mtime_ns, digest
+
+
+def _fingerprints(conf, files):
+    """
+    Returns the fingerprints of the configuration file *conf* and the given
+    *files* it was resolved from as a list of ``[path, mtime, sha256]``
+    lists.
+    """
+    paths = [os.path.abspath(conf)]
+    for file in files:
+        if os.path.abspath(file) not in paths:
+            paths.append(os.path.abspath(file))
+    return [[path] + list(_fingerprint(path)) for path in paths]
+
+
+class CachedConfig:
+    """
+    Pre-resolved subset of a deploy configuration, which is sufficient for
+    commands that neither need the uwsgi module nor any other part of the
+    score configuration.
+    """
+
+    def __init__(self, root, apps):
+        self.root = root
+        self.apps = apps
+
+    @property
+    def statedir(self):
+        return os.path.join(self.root, '.deploy')
+
+    @classmethod
+    def load(cls, conf):
+        """
+        Returns the cached configuration of the file *conf* or `None`, if
+        there is none or the modification time or content of the file, or of
+        any file it was based on, changed since it was cached.
+        """
+        try:
+            with open(cache_file(conf)) as fp:
+                data = json.load(fp)
+            files = data['files']
+            if files[0][0] != os.path.abspath(conf) or \
+                    files != _fingerprints(conf, [file[0] for file in files]):
+                return None
+        except (OSError, ValueError, KeyError, IndexError, TypeError):
+            return None
+        return cls(data['root'], data['apps'])
+
+    @classmethod
+    def store(cls, conf, deploy, files=()):
+        """
+        Caches the relevant parts of the :class:`ConfiguredDeployModule`
+        *deploy*, which was initialized from the file *conf*. The *files*
+        are all other configuration files *conf* was resolved from, like its
+        bases and includes, which invalidate the cache as well.
+        """
+        apps = dict((name, {'repository': app.repository,
+                            'ini': app.paste_ini,
+                            'folder': app.folder})
+                    for name, app in deploy.apps.items())
+        fingerprints = _fingerprints(conf, files)
+        file = cache_file(conf)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        tmpfile = '%s.%d' % (file, os.getpid())
+        with open(tmpfile, 'w') as fp:
+            json.dump({
+                'files': fingerprints,
+                'root': deploy.root,
+                'apps': apps,
+            }, fp)
+        os.rename(tmpfile, file)
+        return cls(deploy.root, apps)
@@ -0,0 +1,264 @@
+# Copyright © 2015 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+from collections import defaultdict
+import glob
+import hashlib
+import json
+import os
+import stat
+
+
+class DiskUsage:
+    """
+    Hardlink-aware disk usage of folder trees. The inodes and sizes of the
+    files in each directory are cached as JSON in *file* and reused as long
+    as the modification time of the directory is unchanged, i.e. no entry
+    was added, removed or renamed. Files modified in place are not noticed
+    until their directory changes.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        try:
+            with open(file) as fp:
+                self._entries = json.load(fp)
+        except (OSError, ValueError):
+            self._entries = {}
+        self._dirty = False
+        self._roots = []
+        self._seen = set()
+
+    def scan(self, folder):
+        """
+        Returns a `dict` mapping ``(device, inode)`` tuples of all files and
+        directories in *folder* to their size in bytes. Each inode is
+        contained only once, no matter how many hard links to it there are.
+        """
+        self._roots.append(folder.rstrip(os.sep) + os.sep)
+        inodes = {}
+        pending = [folder]
+        while pending:
+            path = pending.pop()
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            inodes[(st.st_dev, st.st_ino)] = st.st_blocks * 512
+            entry = self._entries.get(path)
+            if entry is None or entry['mtime'] != st.st_mtime_ns:
+                entry = self._read(path, st)
+                if entry is None:
+                    continue
+            self._seen.add(path)
+            for ino, size in entry['files']:
+                inodes[(entry['dev'], ino)] = size
+            pending += [os.path.join(path, name) for name in entry['dirs']]
+        return inodes
+
+    def _read(self, path, st):
+        files = []
+        dirs = []
+        try:
+            with os.scandir(path) as it:
+                for dirent in it:
+                    if dirent.is_dir(follow_symlinks=False):
+                        dirs.append(dirent.name)
+                        continue
+                    try:
+                        fst = dirent.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    files.append([fst.st_ino, fst.st_blocks * 512])
+        except OSError:
+            return None
+        entry = self._entries[path] = {
+            'mtime': st.st_mtime_ns,
+            'dev': st.st_dev,
+            'files': files,
+            'dirs': dirs,
+        }
+        self._dirty = True
+        return entry
+
+    def save(self):
+        """
+        Writes the cache back, dropping the directories inside the scanned
+        folders that no longer exist.
+        """
+        for path in list(self._entries):
+            if path not in self._seen and any(
+                    path.startswith(root) for root in self._roots):
+                del self._entries[path]
+                self._dirty = True
+        if not self._dirty:
+            return
+        tmpfile = '%s.%d' % (self.file, os.getpid())
+        with open(tmpfile, 'w') as fp:
+            json.dump(self._entries, fp)
+        os.rename(tmpfile, self.file)
+        self._dirty = False
+
+
+def summarize(groups):
+    """
+    Calculates the disk usage of the given *groups*, a `dict` mapping names
+    to the results of :meth:`DiskUsage.scan`. Returns a `dict` mapping each
+    name to a tuple containing its size and its exclusive size, which only
+    counts the inodes not shared with any other group.
+    """
+    owners = defaultdict(int)
+    for inodes in groups.values():
+        for inode in inodes:
+            owners[inode] += 1
+    return dict((name, (sum(inodes.values()),
+                        sum(size for inode, size in inodes.items()
+                            if owners[inode] == 1)))
+                for name, inodes in groups.items())
+
+
+# folders containing files that are never modified in place: files in
+# site-packages are replaced during upgrades, Mercurial breaks hard links
+# before appending to its revlogs and git objects are immutable
+appling_patterns = (
+    ('.venv', 'lib', 'python*', 'site-packages'),
+    ('.hg', 'store'),
+    ('.git', 'objects'),
+)
+venv_patterns = (
+    ('lib', 'python*', 'site-packages'),
+)
+mirror_patterns = (
+    ('.hg', 'store'),
+    ('objects',),
+)
+
+
+def dedup_candidates(folder, patterns):
+    """
+    Returns the paths of all files in the subfolders of *folder* matching
+    any of the given *patterns*, which are tuples of path components that
+    may contain wildcards.
+    """
+    for pattern in patterns:
+        for top in glob.glob(os.path.join(folder, *pattern)):
+            for root, dirs, files in os.walk(top):
+                if root == top and pattern[-1] == 'objects':
+                    dirs[:] = [d for d in dirs if d != 'info']
+                for name in files:
+                    if name.endswith(('.pth', '.egg-link')):
+                        continue
+                    yield os.path.join(root, name)
+
+
+def _digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _same_inode(path, st):
+    try:
+        current = os.lstat(path)
+    except OSError:
+        return False
+    return (current.st_dev, current.st_ino, current.st_size,
+            current.st_mtime_ns) == \
+        (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def dedup(paths, *, dry_run=False):
+    """
+    Replaces identical files among the given *paths* with hard links to a
+    single inode. Files are only linked if they are on the same device and
+    have the same size, mode and owner, Python sources also need the same
+    modification time to keep their bytecode valid. Returns the number of
+    linked files and the number of bytes freed.
+    """
+    inodes = {}
+    for path in paths:
+        try:
+            st = os.lstat(path)
+        except OSError:
+            continue
+        if not stat.S_ISREG(st.st_mode) or not st.st_size:
+            continue
+        key = (st.st_dev, st.st_ino)
+        if key not in inodes:
+            inodes[key] = (st, [])
+        inodes[key][1].append(path)
+    groups = defaultdict(list)
+    for st, links in inodes.values():
+        key = (st.st_dev, st.st_size, st.st_mode, st.st_uid, st.st_gid)
+        if links[0].endswith('.py'):
+            key += (st.st_mtime_ns,)
+        groups[key].append((st, links))
+    linked = freed = 0
+    for candidates in groups.values():
+        if len(candidates) < 2:
+            continue
+        identical = defaultdict(list)
+        for st, links in candidates:
+            try:
+                identical[_digest(links[0])].append((st, links))
+            except OSError:
+                continue
+        for same in identical.values():
+            if len(same) < 2:
+                continue
+            # keep the inode with the most links
+            same.sort(key=lambda item: -item[0].st_nlink)
+            keeper = same[0][1][0]
+            for st, links in same[1:]:
+                if not dry_run and not all(_replace(keeper, link, st)
+                                           for link in links):
+                    continue
+                linked += len(links)
+                if st.st_nlink == len(links):
+                    freed += st.st_blocks * 512
+    return linked, freed
+
+
+def _replace(keeper, path, st):
+    """
+    Atomically replaces *path*, which must still be the inode described by
+    *st*, with a hard link to *keeper*.
+    """
+    if not _same_inode(path, st):
+        return False
+    tmpfile = '%s.dedup.%d' % (path, os.getpid())
+    try:
+        os.link(keeper, tmpfile)
+        os.rename(tmpfile, path)
+    except OSError:
+        try:
+            os.unlink(tmpfile)
+        except OSError:
+            pass
+        return False
+    return True
@@ -0,0 +1,180 @@
+# Copyright © 2015 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+from collections import namedtuple
+import json
+import os
+
+
+Usage = namedtuple('Usage', 'app name memory paused idle')
+Usage.__doc__ = """
+Memory usage of a running zergling as collected by :func:`collect_usage`:
+the :class:`App`, the zergling's name, its memory in bytes, whether it is
+paused and the number of seconds since it was last seen active.
+"""
+
+_pagesize = os.sysconf('SC_PAGE_SIZE')
+
+
+def memory(pid):
+    """
+    Returns the memory used by the process *pid* in bytes: its proportional
+    set size, which splits pages shared with the other workers of a
+    zergling between them, or its resident set size on kernels without
+    ``smaps_rollup``. Returns 0 if there is no such process.
+    """
+    try:
+        with open('/proc/%d/smaps_rollup' % pid) as fp:
+            for line in fp:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/proc/%d/statm' % pid) as fp:
+            return int(fp.read().split()[1]) * _pagesize
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def zergling_usage(zergling):
+    """
+    Reads the stats of a *zergling* and returns its memory (master and
+    workers), whether it is paused and the number of requests its workers
+    have served. Returns `None` if the zergling is not running.
+    """
+    from score.uwsgi import NotRunning
+    try:
+        stats = zergling.read_stats()
+    except NotRunning:
+        return None
+    workers = stats.get('workers', [])
+    pids = set([stats.get('pid')] + [worker.get('pid') for worker in workers])
+    total = sum(memory(pid) for pid in pids if pid)
+    paused = bool(workers) and workers[0].get('status') == 'pause'
+    requests = sum(worker.get('requests', 0) for worker in workers)
+    return total, paused, requests
+
+
+class Activity:
+    """
+    Persistent record of the time each zergling was last seen active, i.e.
+    not paused or serving requests, stored as JSON in *file*.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        try:
+            with open(file) as fp:
+                self._entries = json.load(fp)
+        except (OSError, ValueError):
+            self._entries = {}
+        self._seen = set()
+
+    def observe(self, app, name, paused, requests, now):
+        """
+        Records an observation of a running zergling and returns the number
+        of seconds since it was last active.
+        """
+        key = '%s/%s' % (app, name)
+        self._seen.add(key)
+        entry = self._entries.get(key)
+        if entry is None or not paused or entry[0] != requests:
+            entry = self._entries[key] = [requests, now]
+        return now - entry[1]
+
+    def save(self):
+        """
+        Writes the observations back, dropping all zerglings that were not
+        observed since this object was created.
+        """
+        entries = dict((key, entry) for key, entry in self._entries.items()
+                       if key in self._seen)
+        tmpfile = '%s.%d' % (self.file, os.getpid())
+        with open(tmpfile, 'w') as fp:
+            json.dump(entries, fp)
+        os.rename(tmpfile, self.file)
+
+
+def collect_usage(apps, activity, now):
+    """
+    Returns a list of :class:`Usage` tuples of all running zerglings of the
+    given :class:`App` objects, recording their activity in the given
+    :class:`Activity`.
+    """
+    usages = []
+    for app in apps:
+        for zergling in app.zerglings():
+            usage = zergling_usage(zergling)
+            if usage is None:
+                continue
+            total, paused, requests = usage
+            idle = activity.observe(app.name, zergling.name, paused, requests,
+                                    now)
+            usages.append(Usage(app, zergling.name, total, paused, idle))
+    return usages
+
+
+def _exceeds(limits, total, paused):
+    return (limits.get('memory') is not None and total > limits['memory']) \
+        or (limits.get('paused') is not None and paused > limits['paused'])
+
+
+def _select(usages, limits, min_idle, victims):
+    total = sum(usage.memory for usage in usages)
+    paused = [usage for usage in usages if usage.paused]
+    count = len(paused)
+    # least recently active first
+    for usage in sorted(paused, key=lambda usage: -usage.idle):
+        if not _exceeds(limits, total, count):
+            break
+        if usage.idle < min_idle:
+            break
+        victims.append(usage)
+        total -= usage.memory
+        count -= 1
+
+
+def select_victims(usages, limits):
+    """
+    Selects the paused zerglings to stop, least recently active first, until
+    the memory and the number of paused zerglings of each app and of the
+    whole host are within their *limits*. The per-app limits are taken from
+    each app's ``gc_limits``. Running zerglings and those paused zerglings
+    that have been active in the last ``idle`` seconds are never selected.
+    """
+    victims = []
+    min_idle = limits.get('idle') or 0
+    apps = {}
+    for usage in usages:
+        apps.setdefault(usage.app.name, []).append(usage)
+    for name, app_usages in sorted(apps.items()):
+        app_limits = app_usages[0].app.gc_limits
+        if app_limits:
+            _select(app_usages, app_limits, min_idle, victims)
+    _select([usage for usage in usages if usage not in victims],
+            limits, min_idle, victims)
+    return victims
@@ -0,0 +1,131 @@
+# Copyright © 2015 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+
+import logging
+import socket
+import time
+from urllib.parse import urljoin, urlsplit
+
+
+log = logging.getLogger(__name__)
+
+
+class HealthCheck:
+    """
+    HTTP health check that must pass before an appling is allowed to take
+    over from the other applings of its app.
+
+    The requests are sent to the private HTTP socket of the appling's
+    zergling (see :attr:`AppLing.health_socket`), so they cannot be answered
+    by the other zerglings serving the app. Only the path and query of the
+    *url* are used, its host is sent as ``Host`` header. The *url* may
+    contain the placeholders ``{app}`` and ``{name}``, which are replaced
+    with the names of the app and the appling.
+
+    The *url* is requested repeatedly until it responds successfully or
+    *timeout* seconds have passed. Afterwards, each of the *warmup* URLs
+    (which may be relative to *url*) is requested once. If a *budget* is
+    given, the *url* is then requested once more and must respond within
+    that many seconds.
+    """
+
+    def __init__(self, url, *, warmup=(), budget=None, timeout=30):
+        self.url = url
+        self.warmup = list(warmup)
+        self.budget = budget
+        self.timeout = timeout
+
+    def _request(self, socket_path, url, timeout):
+        """
+        Sends a GET request for *url* to the unix socket *socket_path* and
+        returns the number of seconds it took. Raises an :class:`OSError` or
+        an :class:`http.client.HTTPException` if it fails.
+        """
+        import http.client
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        start = time.monotonic()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        connection = http.client.HTTPConnection(parts.netloc or 'localhost',
+                                                timeout=timeout)
+        try:
+            sock.connect(socket_path)
+            connection.sock = sock
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+        finally:
+            connection.close()
+            sock.close()
+        if response.status >= 400:
+            raise http.client.HTTPException('%d %s' % (response.status,
+                                                       response.reason))
+        return time.monotonic() - start
+
+    def check(self, appling):
+        """
+        Performs the check against given :class:`AppLing`. Raises an
+        exception describing the problem if the check fails, returns the
+        latency of the last request to the health URL otherwise.
+        """
+        import http.client
+        errors = (OSError, http.client.HTTPException)
+        sock = appling.health_socket
+        url = self.url.format(app=appling.app.name, name=appling.name)
+        deadline = time.monotonic() + self.timeout
+        delay = 0.1
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                latency = self._request(sock, url, max(0.1, remaining))
+                break
+            except errors as e:
+                if remaining <= delay:
+                    raise Exception('Health check of %s failed: %s' %
+                                    (appling, e))
+            time.sleep(delay)
+            delay = min(delay * 2, 1)
+        for path in self.warmup:
+            try:
+                self._request(sock, urljoin(url, path), self.timeout)
+            except errors as e:
+                raise Exception('Warmup request %s of %s failed: %s' %
+                                (path, appling, e))
+        if self.budget is None:
+            return latency
+        try:
+            latency = self._request(sock, url, self.timeout)
+        except errors as e:
+            raise Exception('Health check of %s failed: %s' % (appling, e))
+        if latency > self.budget:
+            raise Exception('Health check of %s took %.3fs (budget: %.3fs)' %
+                            (appling, latency, self.budget))
+        log.info('Health check of %s passed in %.3fs' % (appling, latency))
+        return latency
@@ -26,11 +26,34 @@
 
 
 from score.init import ConfigurationError, ConfiguredModule
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import importlib
 import os
-from ._app import App
+import time
+from ._app import App, AppLing, NoSuchAppling
+from ._disk import (
+    DiskUsage, appling_patterns, dedup, dedup_candidates, mirror_patterns,
+    summarize, venv_patterns)
+from ._gc import Activity, collect_usage, select_victims
+from ._vcs import drivers, working_revision
+from ._health import HealthCheck
+from ._registry import Registry
+from ._timing import Journal
+from ._trash import Trash
+from ._venv import VenvCache
 
 
 defaults = {
+    'spares': '0',
+    'start_timeout': '60',
+    'state_ttl': '2',
+    'timing.hook': None,
+    'recycle.max_count': '5',
+    'recycle.max_age': None,
+    'recycle.max_size': None,
+    'gc.max_memory': None,
+    'gc.max_paused': None,
+    'gc.min_idle': '60',
 }
 
 
@@ -45,23 +68,110 @@ def init(confdict, uwsgi):
                                  conf['rootdir'])
     apps = {}
     for key in conf:
-        if not key.endswith('.hg'):
+        name, _, vcsname = key.rpartition('.')
+        if not name or vcsname not in drivers:
             continue
-        name = key[:-3]
+        if name in apps:
+            raise ConfigurationError(__package__,
+                                     'Multiple repositories for ' + name)
+        vcs = _init_vcs(conf, name, vcsname)
         inikey = '%s.ini' % name
         if inikey not in conf:
             raise ConfigurationError(__package__,
                                      'No ini path provided for ' + name)
-        apps[name] = App(name, conf[key], conf[inikey])
-    return ConfiguredDeployModule(uwsgi, conf['rootdir'], apps)
+        spares = int(conf.get('%s.spares' % name, conf['spares']))
+        health = None
+        if '%s.health.url' % name in conf:
+            budget = conf.get('%s.health.budget' % name)
+            health = HealthCheck(
+                conf['%s.health.url' % name],
+                warmup=conf.get('%s.health.warmup' % name, '').split(),
+                budget=float(budget) if budget else None,
+                timeout=float(conf.get('%s.health.timeout' % name, 30)))
+        apps[name] = App(name, conf[key], conf[inikey], spares, health, vcs,
+                         _gc_limits(conf, '%s.gc.' % name))
+    recycle_limits = {
+        'count': int(conf['recycle.max_count']),
+        'age': None,
+        'size': None,
+    }
+    if conf['recycle.max_age']:
+        recycle_limits['age'] = float(conf['recycle.max_age'])
+    if conf['recycle.max_size']:
+        recycle_limits['size'] = int(conf['recycle.max_size'])
+    gc_limits = _gc_limits(conf, 'gc.')
+    gc_limits['idle'] = float(conf['gc.min_idle'])
+    timing_hook = None
+    if conf['timing.hook']:
+        modname, funcname = conf['timing.hook'].rsplit('.', 1)
+        try:
+            timing_hook = getattr(importlib.import_module(modname), funcname)
+        except (ImportError, AttributeError):
+            raise ConfigurationError(__package__,
+                                     'Could not load timing hook ' +
+                                     conf['timing.hook'])
+    return ConfiguredDeployModule(uwsgi, conf['rootdir'], apps,
+                                  timing_hook=timing_hook,
+                                  start_timeout=float(conf['start_timeout']),
+                                  state_ttl=float(conf['state_ttl']),
+                                  recycle_limits=recycle_limits,
+                                  gc_limits=gc_limits,
+                                  confdict=confdict)
+
+
+def _gc_limits(conf, prefix):
+    """
+    Reads the limits for stopping paused zerglings from the keys
+    ``max_memory`` (in bytes) and ``max_paused`` with given *prefix*.
+    """
+    limits = {}
+    for key, name in (('max_memory', 'memory'), ('max_paused', 'paused')):
+        value = conf.get(prefix + key)
+        limits[name] = int(value) if value else None
+    return limits
+
+
+def _init_vcs(conf, name, vcsname):
+    """
+    Creates the VCS driver of app *name*, which is configured with the keys
+    ``<name>.revision`` (the branch to deploy), ``<name>.sparse`` (the paths
+    to check out) and ``<name>.depth`` (the length of history to fetch, only
+    supported by git).
+    """
+    kwargs = {
+        'revision': conf.get('%s.revision' % name) or None,
+        'sparse': conf.get('%s.sparse' % name, '').split(),
+    }
+    depth = conf.get('%s.depth' % name)
+    if depth:
+        if vcsname != 'git':
+            raise ConfigurationError(__package__,
+                                     'Shallow clones are only supported by '
+                                     'git, see ' + name + '.depth')
+        kwargs['depth'] = int(depth)
+    return drivers[vcsname](**kwargs)
 
 
 class ConfiguredDeployModule(ConfiguredModule):
 
-    def __init__(self, uwsgi, root, apps):
+    def __init__(self, uwsgi, root, apps, *, start_timeout=60, state_ttl=2,
+                 recycle_limits=None, gc_limits=None, timing_hook=None,
+                 confdict=None):
         super().__init__(__package__)
         self.uwsgi = uwsgi
+        # the configuration this module was initialized with, which is
+        # passed to detached helper processes
+        self.confdict = confdict
         self.root = root
+        self._timing_hook = timing_hook
+        self.start_timeout = start_timeout
+        self.state_ttl = state_ttl
+        if recycle_limits is None:
+            recycle_limits = {'count': 5, 'age': None, 'size': None}
+        self.recycle_limits = recycle_limits
+        if gc_limits is None:
+            gc_limits = {'memory': None, 'paused': None, 'idle': 60}
+        self.gc_limits = gc_limits
         self._apps = apps
         for name in apps:
             apps[name].conf = self
@@ -69,3 +179,214 @@ class ConfiguredDeployModule(ConfiguredModule):
     @property
     def apps(self):
         return dict(self._apps.items())
+
+    @property
+    def statedir(self):
+        """
+        Folder for the persistent state of this module (caches, indexes,
+        etc.) inside the root folder.
+        """
+        path = os.path.join(self.root, '.deploy')
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    @property
+    def journal(self):
+        """
+        The :class:`Journal` recording the durations of deployment phases.
+        """
+        return Journal(os.path.join(self.statedir, 'journal.jsonl'),
+                       self._timing_hook)
+
+    @property
+    def trash(self):
+        """
+        The :class:`Trash` for deleting folders in the background.
+        """
+        return Trash(os.path.join(self.statedir, 'trash'))
+
+    @property
+    def venvs(self):
+        """
+        The :class:`VenvCache` shared by all apps. It is limited like the
+        recycled folders of each app (the ``recycle.max_*`` keys).
+        """
+        return VenvCache(os.path.join(self.statedir, 'venvs'),
+                         limits=self.recycle_limits, trash=self.trash)
+
+    @property
+    def registry(self):
+        """
+        The :class:`Registry` of all applings.
+        """
+        return Registry(os.path.join(self.statedir, 'registry.json'))
+
+    def reconcile(self, apps=None):
+        """
+        Rebuilds the :attr:`registry` entries of given app names (or all
+        apps) from the actual zerglings.
+        """
+        if apps is None:
+            apps = self._apps
+        registry = self.registry
+        for name in apps:
+            app = self._apps[name]
+            applings = {}
+            for ling, zergling in app.snapshot().items():
+                folder = os.path.join(app.folder, ling)
+                if zergling.running:
+                    state = 'running'
+                elif zergling.starting:
+                    state = 'starting'
+                else:
+                    state = 'stopped'
+                applings[ling] = {
+                    'folder': folder,
+                    'revision': working_revision(folder),
+                    'state': state,
+                }
+            registry.replace(name, applings)
+
+    def collect_garbage(self, *, dry_run=False):
+        """
+        Stops paused zerglings, least recently active first, while the
+        configured ``gc`` limits on memory or the number of paused zerglings
+        of an app or of the whole host are exceeded. Returns the
+        :class:`Usage` tuples of all running zerglings and of those that were
+        stopped (or would have been stopped, if *dry_run* is `True`).
+        """
+        activity = Activity(os.path.join(self.statedir, 'activity.json'))
+        usages = collect_usage(self._apps.values(), activity, time.time())
+        victims = select_victims(usages, self.gc_limits)
+        if not dry_run:
+            for usage in victims:
+                usage.app.appling(usage.name).stop()
+        activity.save()
+        return usages, victims
+
+    def _folders(self):
+        """
+        Yields tuples of an app name, the name of a folder of this app and
+        the path to the folder. The folders of the :attr:`statedir` are
+        listed as folders of an app called ``.deploy``.
+        """
+        for name, app in sorted(self._apps.items()):
+            if not os.path.isdir(app.folder):
+                continue
+            for folder_name in sorted(os.listdir(app.folder)):
+                yield name, folder_name, os.path.join(app.folder, folder_name)
+        for folder_name in sorted(os.listdir(self.statedir)):
+            yield '.deploy', folder_name, \
+                os.path.join(self.statedir, folder_name)
+
+    def disk_usage(self):
+        """
+        Calculates the disk usage of all apps, counting files with multiple
+        hard links only once. Returns a `dict` mapping app names to `dict`
+        values containing the ``size`` of the app, its ``exclusive`` size
+        (ignoring files shared with other apps) and its ``folders``, which
+        contain the same information for each folder of the app. The
+        ``total`` contains the size of all apps.
+        """
+        cache = DiskUsage(os.path.join(self.statedir, 'du.json'))
+        folders = {}
+        apps = {}
+        for name, folder_name, folder in self._folders():
+            inodes = cache.scan(folder)
+            folders[(name, folder_name)] = inodes
+            apps.setdefault(name, {}).update(inodes)
+        cache.save()
+        folder_sizes = summarize(folders)
+        result = dict((name, {
+            'size': size,
+            'exclusive': exclusive,
+            'folders': {},
+        }) for name, (size, exclusive) in summarize(apps).items())
+        for (name, folder_name), (size, exclusive) in folder_sizes.items():
+            result[name]['folders'][folder_name] = {
+                'size': size,
+                'exclusive': exclusive,
+            }
+        total = {}
+        for inodes in apps.values():
+            total.update(inodes)
+        result['total'] = sum(total.values())
+        return result
+
+    def deduplicate(self, *, dry_run=False):
+        """
+        Replaces identical immutable files of all applings, cached
+        virtualenvs and mirrors with hard links to a single file. Returns
+        the number of replaced files and the number of bytes freed.
+        """
+        paths = []
+        for name, folder_name, folder in self._folders():
+            if folder_name.startswith(('_building_', '_forking_')):
+                # folder is being created
+                continue
+            if name != '.deploy':
+                paths += dedup_candidates(folder, appling_patterns)
+                continue
+            if folder_name == 'venvs':
+                patterns = venv_patterns
+            elif folder_name == 'mirrors':
+                patterns = mirror_patterns
+            else:
+                continue
+            for child in sorted(os.listdir(folder)):
+                if '.' in child and child.rpartition('.')[2].isdigit():
+                    # temporary folder of a concurrent process
+                    continue
+                paths += dedup_candidates(os.path.join(folder, child),
+                                          patterns)
+        return dedup(paths, dry_run=dry_run)
+
+    def find_applings(self, name, app=None):
+        """
+        Returns all :class:`AppLing` objects called *name* (or, if there are
+        none, those whose name starts with *name*), optionally limited to
+        the app with given name. Applings are looked up in the
+        :attr:`registry`, which is reconciled if it does not know an appling
+        called *name* or if its information is outdated. Names are only
+        matched by prefix after reconciling, as the registry might not know
+        the appling called *name* yet.
+        """
+        if app is not None and app not in self._apps:
+            raise NoSuchAppling('No such app: %s' % app)
+
+        def lookup(prefix):
+            found = self.registry.lookup(name, app, prefix=prefix)
+            for appname, ling, info in found:
+                if appname not in self._apps or \
+                        not os.path.isdir(info.get('folder', '')):
+                    return None
+            return found
+        found = lookup(False)
+        if not found:
+            self.reconcile([app] if app is not None else None)
+            found = lookup(False) or lookup(True) or []
+        return [AppLing(self._apps[appname], ling)
+                for appname, ling, info in found]
+
+    def initialize(self, *, jobs=1, callback=None):
+        """
+        Initializes all apps, running at most *jobs* initializations
+        concurrently. The optional *callback* is invoked with the name of
+        each app and the exception its initialization raised (or `None`) as
+        soon as it is done.
+
+        Returns a `dict` mapping the names of all apps that could not be
+        initialized to the exceptions that were raised.
+        """
+        errors = {}
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            futures = dict((pool.submit(self._apps[name].initialize), name)
+                           for name in sorted(self._apps))
+            for future in as_completed(futures):
+                name = futures[future]
+                error = future.exception()
+                if error is not None:
+                    errors[name] = error
+                if callback:
+                    callback(name, error)
+        return errors
@@ -0,0 +1,272 @@
+# Copyright © 2015 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+
+from bisect import bisect_right
+from datetime import datetime
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+
+
+_timestamp_formats = (
+    # uwsgi: [Sat Oct 17 10:00:00 2026]
+    (re.compile(rb'\[(\w{3} \w{3} +\d{1,2} \d\d:\d\d:\d\d \d{4})\]'),
+     '%a %b %d %H:%M:%S %Y'),
+    # uwsgi with logdate: Sat Oct 17 10:00:00 2026 - message
+    (re.compile(rb'^(\w{3} \w{3} +\d{1,2} \d\d:\d\d:\d\d \d{4}) - '),
+     '%a %b %d %H:%M:%S %Y'),
+    # python logging: 2026-10-17 10:00:00,123
+    (re.compile(rb'(\d{4}-\d\d-\d\d)[ T](\d\d:\d\d:\d\d)'),
+     '%Y-%m-%d %H:%M:%S'),
+)
+
+
+def tail_offset(file, lines, *, blocksize=65536):
+    """
+    Returns the offset of the beginning of the last *lines* lines in the
+    binary *file*, reading it backwards from its end.
+    """
+    end = file.seek(0, os.SEEK_END)
+    if lines <= 0:
+        return end
+    position = end
+    found = 0
+    # a trailing newline terminates the last line, it does not start a new one
+    skip_last = True
+    while position > 0:
+        size = min(blocksize, position)
+        position -= size
+        file.seek(position)
+        block = file.read(size)
+        index = len(block)
+        if skip_last:
+            skip_last = False
+            if block.endswith(b'\n'):
+                index -= 1
+        while True:
+            index = block.rfind(b'\n', 0, index)
+            if index < 0:
+                break
+            found += 1
+            if found == lines:
+                return position + index + 1
+    return 0
+
+
+def stream(file, output, *, start=None, follow=False, pattern=None,
+           interval=0.2, blocksize=65536):
+    """
+    Copies the binary *file* to the binary *output* stream, starting at
+    offset *start*. If *follow* is `True`, keeps waiting for new data until
+    interrupted. If a *pattern* (a `bytes` regular expression) is given,
+    only lines matching it are written.
+    """
+    if start is not None:
+        file.seek(start)
+    regex = re.compile(pattern) if pattern is not None else None
+    rest = b''
+    while True:
+        chunk = file.read(blocksize)
+        if not chunk:
+            if not follow:
+                break
+            output.flush()
+            time.sleep(interval)
+            continue
+        if regex is None:
+            output.write(chunk)
+            continue
+        lines = (rest + chunk).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            if regex.search(line):
+                output.write(line + b'\n')
+    if rest and regex.search(rest):
+        output.write(rest)
+    output.flush()
+
+
+def parse_timestamp(line):
+    """
+    Extracts the timestamp of a log *line* as seconds since the epoch.
+    Returns `None` if the line does not contain a known timestamp format.
+    """
+    for regex, format in _timestamp_formats:
+        match = regex.search(line)
+        if not match:
+            continue
+        value = b' '.join(match.groups()).decode('ascii')
+        try:
+            return time.mktime(time.strptime(value, format))
+        except ValueError:
+            continue
+    return None
+
+
+def parse_time(value):
+    """
+    Parses a point in time given on the command line, either as a date (and
+    time) in ISO format or relative to now (``90s``, ``15m``, ``2h``,
+    ``1d``). Returns seconds since the epoch.
+    """
+    match = re.match(r'^(\d+)([smhd])$', value)
+    if match:
+        factor = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+        return time.time() - int(match.group(1)) * factor
+    for format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S',
+                   '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return time.mktime(datetime.strptime(value, format).timetuple())
+        except ValueError:
+            pass
+    raise ValueError('Invalid time: %s' % value)
+
+
+class LogIndex:
+    """
+    Sidecar index of a log file mapping time buckets of *bucket* seconds to
+    the offset of the first line in that bucket. The index is stored in
+    *indexfile* and brought up to date incrementally by :meth:`update`. It is
+    rebuilt from scratch if the log file was rotated or truncated.
+    """
+
+    headsize = 256
+
+    def __init__(self, logfile, indexfile, *, bucket=60):
+        self.logfile = logfile
+        self.indexfile = indexfile
+        self.bucket = bucket
+        self.buckets = []
+        self.offsets = []
+
+    def _load(self, st, head):
+        try:
+            with open(self.indexfile) as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            return 0, None
+        if data.get('inode') != st.st_ino or \
+                data.get('bucket') != self.bucket or \
+                data.get('head') != head or \
+                data.get('size', 0) > st.st_size:
+            # rotated, truncated or replaced
+            return 0, None
+        self.buckets = [entry[0] for entry in data['entries']]
+        self.offsets = [entry[1] for entry in data['entries']]
+        return data['size'], data.get('last')
+
+    def update(self):
+        """
+        Indexes all complete lines appended to the log file since the last
+        update.
+        """
+        self.buckets = []
+        self.offsets = []
+        with open(self.logfile, 'rb') as file:
+            st = os.fstat(file.fileno())
+            head = hashlib.sha1(file.read(self.headsize)).hexdigest()
+            offset, last = self._load(st, head)
+            file.seek(offset)
+            for line in file:
+                if not line.endswith(b'\n'):
+                    # incomplete line, index it during the next update
+                    break
+                timestamp = parse_timestamp(line)
+                if timestamp is not None:
+                    bucket = int(timestamp // self.bucket) * self.bucket
+                    if last is None or bucket > last:
+                        self.buckets.append(bucket)
+                        self.offsets.append(offset)
+                        last = bucket
+                offset += len(line)
+        os.makedirs(os.path.dirname(self.indexfile), exist_ok=True)
+        # the daemon may update the same index in concurrent threads
+        fd, tmpfile = tempfile.mkstemp(
+            dir=os.path.dirname(self.indexfile),
+            prefix=os.path.basename(self.indexfile) + '.')
+        with os.fdopen(fd, 'w') as fp:
+            json.dump({
+                'inode': st.st_ino,
+                'head': head,
+                'bucket': self.bucket,
+                'size': offset,
+                'last': last,
+                'entries': list(zip(self.buckets, self.offsets)),
+            }, fp)
+        os.rename(tmpfile, self.indexfile)
+
+    def range(self, since=None, until=None):
+        """
+        Returns the offsets ``(start, end)`` of the part of the log file that
+        contains all lines between the timestamps *since* and *until*. The
+        *end* is `None` if the part extends to the end of the file.
+        """
+        start = 0
+        if since is not None:
+            index = bisect_right(self.buckets, since) - 1
+            if index >= 0:
+                start = self.offsets[index]
+        end = None
+        if until is not None:
+            index = bisect_right(self.buckets, until)
+            if index < len(self.offsets):
+                end = self.offsets[index]
+        return start, end
+
+
+def stream_window(file, output, start, end, *, since=None, until=None,
+                  pattern=None):
+    """
+    Writes the lines between the offsets *start* and *end* of the binary
+    *file* to *output*, that were logged between *since* and *until*. Lines
+    without a timestamp are attributed to the last timestamp before them.
+    """
+    regex = re.compile(pattern) if pattern is not None else None
+    file.seek(start)
+    position = start
+    timestamp = None
+    for line in file:
+        if end is not None and position >= end:
+            break
+        position += len(line)
+        parsed = parse_timestamp(line)
+        if parsed is not None:
+            timestamp = parsed
+        if timestamp is not None:
+            if since is not None and timestamp < since:
+                continue
+            if until is not None and timestamp > until:
+                break
+        elif since is not None:
+            continue
+        if regex is not None and not regex.search(line):
+            continue
+        output.write(line)
+    output.flush()
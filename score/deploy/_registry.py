@@ -0,0 +1,108 @@
+# Copyright © 2015 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+
+from contextlib import contextmanager
+import fcntl
+import json
+import os
+import time
+
+
+class Registry:
+    """
+    Persistent index of all known applings, stored as JSON in *file*. It maps
+    app names to appling names to `dict` values containing the appling's
+    ``folder``, its ``revision``, its last known ``state`` and the time of
+    the last change (``updated``).
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def load(self):
+        try:
+            with open(self.file) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    @contextmanager
+    def edit(self):
+        """
+        Context manager providing the registry's data for modification. The
+        data is written back when the context is left without an exception.
+        Concurrent edits are serialized with a lock file.
+        """
+        with open(self.file + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            data = self.load()
+            yield data
+            tmpfile = '%s.%d' % (self.file, os.getpid())
+            with open(tmpfile, 'w') as fp:
+                json.dump(data, fp, indent=1, sort_keys=True)
+            os.rename(tmpfile, self.file)
+
+    def set(self, app, name, **info):
+        """
+        Adds the appling *name* of *app* or updates the given *info* fields.
+        """
+        with self.edit() as data:
+            entry = data.setdefault(app, {}).setdefault(name, {})
+            entry.update(info)
+            entry['updated'] = time.time()
+
+    def remove(self, app, name):
+        with self.edit() as data:
+            data.get(app, {}).pop(name, None)
+
+    def replace(self, app, applings):
+        """
+        Replaces all entries of *app* with given `dict` of *applings*.
+        """
+        now = time.time()
+        with self.edit() as data:
+            previous = data.get(app, {})
+            data[app] = {}
+            for name, info in applings.items():
+                entry = dict(previous.get(name, {}))
+                entry.update(info)
+                entry['updated'] = now
+                data[app][name] = entry
+
+    def lookup(self, name, app=None, *, prefix=False):
+        """
+        Returns a list of ``(app, name, info)`` tuples of all applings called
+        *name* or, if *prefix* is `True`, of all applings whose name starts
+        with *name*. The search can be limited to a single *app*.
+        """
+        data = self.load()
+        if app is not None:
+            data = {app: data.get(app, {})}
+        return [(appname, ling, applings[ling])
+                for appname, applings in sorted(data.items())
+                for ling in sorted(applings)
+                if ling == name or (prefix and ling.startswith(name))]
@@ -0,0 +1,418 @@
+# Copyright © 2015 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+
+from collections import OrderedDict
+import fcntl
+import hashlib
+import io
+import itertools
+import json
+import logging
+import os
+import queue
+import socket
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+import click
+
+
+log = logging.getLogger(__name__)
+
+# commands that do not change any state and are not queued
+readonly_commands = ('status', 'log', 'stats', 'jobs')
+
+_header = struct.Struct('!cI')
+
+# pid, uid and gid of the peer of a unix socket
+_peercred = struct.Struct('3i')
+
+
+def socket_path(conf):
+    """
+    Returns the path of the unix socket of the daemon serving the
+    configuration file *conf*. The socket is placed in a folder only the
+    current user can access, which is created if necessary.
+    """
+    digest = hashlib.sha1(os.path.abspath(conf).encode('utf-8')).hexdigest()
+    base = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    folder = os.path.join(base, 'score-deploy-%d' % os.getuid())
+    try:
+        os.mkdir(folder, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(folder)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or \
+            info.st_mode & 0o077:
+        raise Exception('Folder %s is not private to the current user' %
+                        folder)
+    return os.path.join(folder, '%s.sock' % digest[:12])
+
+
+def _check_peer(sock, path):
+    """
+    Raises a :class:`PermissionError` if the process listening on the
+    connected unix socket *sock* belongs to another user.
+    """
+    if hasattr(socket, 'SO_PEERCRED'):
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                _peercred.size)
+        uid = _peercred.unpack(creds)[1]
+    else:
+        uid = os.stat(path).st_uid
+    if uid != os.getuid():
+        raise PermissionError('Socket %s belongs to another user' % path)
+
+
+def is_listening(path):
+    """
+    Whether a daemon of the current user accepts connections on the unix
+    socket *path*.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        _check_peer(sock, path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def _send(sock, kind, payload):
+    sock.sendall(_header.pack(kind, len(payload)) + payload)
+
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Connection closed by daemon')
+        data += chunk
+    return data
+
+
+def forward(path, args, *, detach=False):
+    """
+    Sends the command line *args* to the daemon listening on *path*, copies
+    its output to this process' stdout and stderr and returns the exit code
+    of the command. Raises an :class:`OSError` if the daemon is not
+    reachable or not run by the current user.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        _check_peer(sock, path)
+    except OSError:
+        sock.close()
+        raise
+    stdout = sys.stdout.buffer
+    stderr = sys.stderr.buffer
+    try:
+        request = json.dumps({'args': args, 'detach': detach})
+        _send(sock, b'r', request.encode('utf-8'))
+        while True:
+            kind, size = _header.unpack(_recv_exactly(sock, _header.size))
+            payload = _recv_exactly(sock, size)
+            if kind == b'o':
+                stdout.write(payload)
+                stdout.flush()
+            elif kind == b'e':
+                stderr.write(payload)
+                stderr.flush()
+            elif kind == b'x':
+                return int(payload)
+    except ConnectionError as e:
+        # the command might have been executed, do not retry it locally
+        stderr.write(('Error: %s\n' % e).encode('utf-8'))
+        stderr.flush()
+        return 1
+    finally:
+        sock.close()
+
+
+class _Output(io.RawIOBase):
+    """
+    Binary stream sending everything written to it as frames of given
+    *kind* to a socket.
+    """
+
+    def __init__(self, sock, kind):
+        self.sock = sock
+        self.kind = kind
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        try:
+            _send(self.sock, self.kind, bytes(data))
+        except OSError as e:
+            # not a BrokenPipeError, which click would handle by replacing
+            # the process' sys.stdout
+            raise ConnectionError('Connection closed by client') from e
+        return len(data)
+
+    def flush(self):
+        # called by commands waiting for something to write (like log
+        # --follow), which would otherwise never notice a gone client
+        try:
+            data = self.sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            raise ConnectionError('Connection closed by client') from e
+        if not data:
+            raise ConnectionError('Connection closed by client')
+
+
+class _BufferedOutput(io.BufferedWriter):
+    """
+    Buffered :class:`_Output`, which passes calls to :meth:`flush` on to
+    it.
+    """
+
+    def flush(self):
+        super().flush()
+        self.raw.flush()
+
+
+class _StreamProxy:
+    """
+    Replacement for sys.stdout/sys.stderr, which writes to a stream
+    registered for the current thread or to the original stream otherwise.
+    """
+
+    def __init__(self, default):
+        self._default = default
+        self._local = threading.local()
+
+    def redirect(self, stream):
+        self._local.stream = stream
+
+    def _stream(self):
+        return getattr(self._local, 'stream', None) or self._default
+
+    def fileno(self):
+        # subprocesses write to the daemon's own stream
+        return self._default.fileno()
+
+    def __getattr__(self, name):
+        return getattr(self._stream(), name)
+
+
+class Job:
+
+    def __init__(self, id, args):
+        self.id = id
+        self.args = args
+        self.state = 'queued'
+        self.exit_code = None
+        self.queued = time.time()
+        self.finished = None
+        self.output = io.BytesIO()
+
+    def as_dict(self):
+        return OrderedDict((
+            ('id', self.id),
+            ('args', self.args),
+            ('state', self.state),
+            ('exit_code', self.exit_code),
+            ('queued', self.queued),
+            ('finished', self.finished),
+            ('output', self.output.getvalue()[-4096:].decode(
+                'utf-8', 'replace')),
+        ))
+
+
+class Server:
+    """
+    Controller daemon executing commands of the click *group* with the
+    already initialized score object *obj*. Commands that change state are
+    executed one after another by a single worker, read-only commands are
+    answered immediately.
+    """
+
+    def __init__(self, group, conf, obj, path):
+        self.group = group
+        self.conf = conf
+        self.obj = obj
+        self.path = path
+        self.jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._scheduled = []
+
+    def _execute(self, args, stdout, stderr):
+        """
+        Runs the command line *args* writing its output to the given text
+        streams and returns its exit code.
+        """
+        sys.stdout.redirect(stdout)
+        sys.stderr.redirect(stderr)
+        try:
+            self.group.main(args=[self.conf] + list(args), prog_name='deploy',
+                            standalone_mode=False, obj=self.obj)
+            return 0
+        except click.ClickException as e:
+            e.show(file=stderr)
+            return e.exit_code
+        except click.Abort:
+            stderr.write('Aborted!\n')
+            return 1
+        except SystemExit as e:
+            return e.code or 0
+        except ConnectionError:
+            log.info('Client of %s disconnected' % ' '.join(args))
+            return 1
+        except Exception as e:
+            log.exception('Error executing %s' % ' '.join(args))
+            stderr.write('Error: %s\n' % e)
+            return 1
+        finally:
+            try:
+                stdout.flush()
+                stderr.flush()
+            except ConnectionError:
+                pass
+            sys.stdout.redirect(None)
+            sys.stderr.redirect(None)
+
+    def _work(self):
+        while True:
+            job, stdout, stderr, done = self._queue.get()
+            job.state = 'running'
+            job.exit_code = self._execute(job.args, stdout, stderr)
+            job.state = 'finished'
+            job.finished = time.time()
+            if done:
+                done.set()
+
+    def submit(self, args, stdout, stderr, *, wait=True):
+        """
+        Queues the command line *args* and returns its :class:`Job`. If
+        *wait* is `True`, returns only after the job has finished.
+        """
+        with self._lock:
+            job = Job(next(self._ids), args)
+            self.jobs[job.id] = job
+            while len(self.jobs) > 100:
+                self.jobs.popitem(last=False)
+        done = threading.Event() if wait else None
+        self._queue.put((job, stdout, stderr, done))
+        if done:
+            done.wait()
+        return job
+
+    def schedule(self, args, interval):
+        """
+        Queues the command line *args* every *interval* seconds, once the
+        server is running. The jobs are listed by the ``jobs`` command.
+        """
+        def run():
+            while True:
+                time.sleep(interval)
+                output = io.TextIOWrapper(io.BytesIO(), encoding='utf-8',
+                                          write_through=True)
+                job = self.submit(args, output, output)
+                job.output = output.buffer
+        self._scheduled.append(run)
+
+    def handle(self, sock):
+        kind, size = _header.unpack(_recv_exactly(sock, _header.size))
+        request = json.loads(_recv_exactly(sock, size).decode('utf-8'))
+        args = request['args']
+        stdout = io.TextIOWrapper(_BufferedOutput(_Output(sock, b'o')),
+                                  encoding='utf-8', write_through=True)
+        stderr = io.TextIOWrapper(_BufferedOutput(_Output(sock, b'e')),
+                                  encoding='utf-8', write_through=True)
+        if args and args[0] == 'jobs':
+            stdout.write(json.dumps(
+                [job.as_dict() for job in self.jobs.values()], indent=2))
+            stdout.write('\n')
+            exit_code = 0
+        elif args and args[0] in readonly_commands:
+            exit_code = self._execute(args, stdout, stderr)
+        elif request.get('detach'):
+            output = io.TextIOWrapper(io.BytesIO(), encoding='utf-8',
+                                      write_through=True)
+            job = self.submit(args, output, output, wait=False)
+            job.output = output.buffer
+            stdout.write('Queued job %d\n' % job.id)
+            exit_code = 0
+        else:
+            exit_code = self.submit(args, stdout, stderr).exit_code
+        stdout.flush()
+        stderr.flush()
+        _send(sock, b'x', str(exit_code).encode('ascii'))
+
+    def serve_forever(self):
+        import socketserver
+        sys.stdout = _StreamProxy(sys.stdout)
+        sys.stderr = _StreamProxy(sys.stderr)
+        threading.Thread(target=self._work, daemon=True).start()
+        for run in self._scheduled:
+            threading.Thread(target=run, daemon=True).start()
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                try:
+                    server.handle(self.request)
+                except ConnectionError:
+                    pass
+
+        class UnixServer(socketserver.ThreadingMixIn,
+                         socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        # held while serving, so concurrently started daemons cannot remove
+        # each other's socket
+        with open(self.path + '.lock', 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise Exception('Another daemon is serving %s' % self.path)
+            if is_listening(self.path):
+                raise Exception('Another daemon is serving %s' % self.path)
+            if os.path.exists(self.path):
+                # stale socket of a daemon that did not shut down cleanly
+                os.unlink(self.path)
+            with UnixServer(self.path, Handler) as unixserver:
+                os.chmod(self.path, 0o600)
+                log.info('Listening on %s' % self.path)
+                try:
+                    unixserver.serve_forever()
+                finally:
+                    os.unlink(self.path)
@@ -0,0 +1,196 @@
+# Copyright © 2015 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+
+import json
+import os
+from subprocess import Popen, PIPE, TimeoutExpired
+import tempfile
+
+from . import _vcs
+
+
+def vcs_status(folder, timeout=None):
+    """
+    Returns a list of status flags for the working copy in *folder*. The list
+    is either empty, contains the string ``modified`` or the error message of
+    the VCS.
+    """
+    driver = _vcs.detect(folder)
+    if driver is None:
+        return ['no working copy']
+    proc = Popen(driver.status(), cwd=folder, stdout=PIPE, stderr=PIPE)
+    try:
+        out, err = proc.communicate(timeout=timeout)
+    except TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        return ['vcs timeout']
+    if proc.returncode:
+        return [err.decode('utf-8', 'replace').strip()]
+    if out:
+        return ['modified']
+    return []
+
+
+def fingerprint(folder):
+    """
+    Calculates a cheap fingerprint of the working copy in *folder*, which
+    changes whenever the repository's dirstate changes or a file in the
+    working copy is added, removed or modified.
+    """
+    driver = _vcs.detect(folder)
+    if driver is None:
+        return None
+    try:
+        dirstate = os.stat(os.path.join(folder, driver.metadir,
+                                        driver.dirstate))
+    except OSError:
+        return None
+    newest = count = size = 0
+    for root, dirs, files in os.walk(folder):
+        if root == folder:
+            dirs[:] = [d for d in dirs if d not in (driver.metadir, '.venv')]
+            files = [f for f in files if f != 'zergling.log']
+        dirs[:] = [d for d in dirs if d != '__pycache__']
+        for name in files:
+            try:
+                st = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            newest = max(newest, st.st_mtime_ns)
+            count += 1
+            size += st.st_size
+    return [dirstate.st_mtime_ns, dirstate.st_size, newest, count, size]
+
+
+class StatusCache:
+    """
+    Persistent cache of :func:`vcs_status` results, keyed on the
+    :func:`fingerprint` of each working copy.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        try:
+            with open(file) as fp:
+                self._entries = json.load(fp)
+        except (OSError, ValueError):
+            self._entries = {}
+        self._dirty = False
+
+    def vcs_status(self, folder, timeout=None):
+        current = fingerprint(folder)
+        entry = self._entries.get(folder)
+        if current is not None and entry and entry[0] == current:
+            return list(entry[1])
+        status = vcs_status(folder, timeout=timeout)
+        if current is not None and status != ['vcs timeout']:
+            self._entries[folder] = [current, status]
+            self._dirty = True
+        return status
+
+    def save(self):
+        if not self._dirty:
+            return
+        # the daemon may save the cache in concurrent threads
+        fd, tmpfile = tempfile.mkstemp(
+            dir=os.path.dirname(self.file),
+            prefix=os.path.basename(self.file) + '.')
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(self._entries, fp)
+        os.rename(tmpfile, self.file)
+        self._dirty = False
+
+
+def zergling_status(state):
+    """
+    Returns the status flags of a zergling, given its :class:`ZerglingState`,
+    in the same form as the ``status`` command of :mod:`score.uwsgi`.
+    """
+    if state.running is None:
+        return ['uwsgi timeout']
+    status = []
+    if state.reloading:
+        status.append('reloading')
+    if state.running:
+        if state.paused:
+            status.append('paused')
+    elif state.starting:
+        status.append('starting')
+    else:
+        status.append('stopped')
+    return status
+
+
+def appling_status(app, state, timeout=None, cache=None):
+    """
+    Collects the status of a single appling: the state of its working copy
+    followed by the state of its zergling, as found in the given
+    :class:`ZerglingState`. The working copy state is looked up in the given
+    :class:`StatusCache`, if there is one.
+    """
+    folder = os.path.join(app.folder, state.zergling.name)
+    if cache is not None:
+        status = cache.vcs_status(folder, timeout=timeout)
+    else:
+        status = vcs_status(folder, timeout=timeout)
+    if status and status != ['modified']:
+        return status
+    return status + zergling_status(state)
+
+
+def collect_status(apps, *, jobs=8, timeout=None, cache=None):
+    """
+    Checks all applings of the given :class:`App` objects concurrently using
+    at most *jobs* threads. The zerglings' states are taken from each app's
+    :meth:`App.snapshot`. The *timeout* applies to each check of a working
+    copy and of a zergling's stats socket. Returns an ordered list of
+    ``(appname, [(name, status), ...])`` tuples, sorted by app and appling
+    name.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        snapshots = [
+            (name, apps[name], pool.submit(apps[name].snapshot, timeout))
+            for name in sorted(apps)]
+        futures = []
+        for name, app, snapshot in snapshots:
+            futures.append((name, [
+                (ling, pool.submit(appling_status, app, state, timeout, cache))
+                for ling, state in sorted(snapshot.result().items())]))
+        result = []
+        for name, applings in futures:
+            statuses = []
+            for ling, future in applings:
+                try:
+                    statuses.append((ling, future.result()))
+                except Exception as e:
+                    statuses.append((ling, [str(e)]))
+            result.append((name, statuses))
+    if cache is not None:
+        cache.save()
+    return result
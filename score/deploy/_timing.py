@@ -0,0 +1,171 @@
+# Copyright © 2015 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+
+from contextlib import contextmanager
+import functools
+import inspect
+import json
+import logging
+import math
+import os
+import time
+
+from ._log import tail_offset
+
+
+log = logging.getLogger(__name__)
+
+
+class Journal:
+    """
+    Records the duration of deployment phases as JSON lines in *file*. The
+    optional *hook* is called with each record (a `dict`) and can be used to
+    forward the timings to an external metrics system.
+    """
+
+    def __init__(self, file, hook=None):
+        self.file = file
+        self.hook = hook
+
+    @contextmanager
+    def span(self, phase, app=None, appling=None):
+        """
+        Context manager measuring the time spent in its body as the given
+        *phase* of an *app* or *appling*.
+        """
+        start = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.record({
+                'time': time.time(),
+                'phase': phase,
+                'app': app,
+                'appling': appling,
+                'duration': time.monotonic() - start,
+                'ok': ok,
+            })
+
+    def record(self, record):
+        line = (json.dumps(record, sort_keys=True) + '\n').encode('utf-8')
+        try:
+            fd = os.open(self.file, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                         0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        except OSError:
+            log.exception('Could not write to journal %s' % self.file)
+        if self.hook:
+            try:
+                self.hook(record)
+            except Exception:
+                log.exception('Error in timing hook')
+
+    def records(self, limit=None):
+        """
+        Returns the last *limit* records of the journal (or all of them).
+        """
+        try:
+            file = open(self.file, 'rb')
+        except FileNotFoundError:
+            return []
+        with file:
+            if limit is not None:
+                file.seek(tail_offset(file, limit))
+            else:
+                file.seek(0)
+            records = []
+            for line in file:
+                try:
+                    records.append(json.loads(line.decode('utf-8')))
+                except ValueError:
+                    continue
+            return records
+
+
+def timed(phase):
+    """
+    Decorator for methods of :class:`App` and :class:`AppLing`, recording
+    their durations in the journal of the configured module.
+    """
+    def decorator(func):
+        def span(self):
+            app = getattr(self, 'app', self)
+            appling = self.name if app is not self else None
+            return app.conf.journal.span(phase, app.name, appling)
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(self, *args, **kwargs):
+                with span(self):
+                    return await func(self, *args, **kwargs)
+        elif inspect.isgeneratorfunction(func):
+            # operations written as steps, see score.deploy._async.drive
+            @functools.wraps(func)
+            def wrapper(self, *args, **kwargs):
+                with span(self):
+                    return (yield from func(self, *args, **kwargs))
+        else:
+            @functools.wraps(func)
+            def wrapper(self, *args, **kwargs):
+                with span(self):
+                    return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def percentile(values, percent):
+    """
+    Returns the given *percent* percentile of the sorted list of *values*
+    using the nearest-rank method.
+    """
+    rank = max(1, int(math.ceil(percent / 100 * len(values))))
+    return values[rank - 1]
+
+
+def summarize(records):
+    """
+    Aggregates successful journal *records* per app and phase. Returns a
+    `dict` mapping app names to `dict` values mapping phase names to tuples
+    ``(count, p50, p95, max)``.
+    """
+    durations = {}
+    for record in records:
+        if not record.get('ok'):
+            continue
+        key = (record.get('app') or '', record['phase'])
+        durations.setdefault(key, []).append(record['duration'])
+    result = {}
+    for (app, phase), values in durations.items():
+        values.sort()
+        result.setdefault(app, {})[phase] = (
+            len(values), percentile(values, 50), percentile(values, 95),
+            values[-1])
+    return result
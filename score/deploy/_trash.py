@@ -0,0 +1,141 @@
+# Copyright © 2015 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+
+import errno
+import itertools
+import os
+import shutil
+from subprocess import Popen, DEVNULL
+import time
+
+
+_counter = itertools.count()
+
+
+def disk_usage(folder):
+    """
+    Returns the number of bytes allocated for the files in *folder*.
+    """
+    usage = 0
+    for root, dirs, files in os.walk(folder):
+        for name in dirs + files:
+            try:
+                usage += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+    return usage
+
+
+def expired(folders, limits):
+    """
+    Returns those of the given *folders* exceeding the *limits* on their
+    number, age and total disk usage, preferring to keep the most recently
+    modified ones. The *limits* are a `dict` with the keys ``count``, ``age``
+    (in seconds) and ``size`` (in bytes), which may be `None`.
+    """
+    entries = []
+    for folder in folders:
+        try:
+            entries.append((os.stat(folder).st_mtime, folder))
+        except FileNotFoundError:
+            continue
+    entries.sort(reverse=True)
+    evicted = []
+    if limits['age'] is not None:
+        threshold = time.time() - limits['age']
+        evicted += [folder for mtime, folder in entries if mtime < threshold]
+        entries = [(mtime, folder) for mtime, folder in entries
+                   if mtime >= threshold]
+    if limits['count'] is not None and len(entries) > limits['count']:
+        evicted += [folder for mtime, folder in entries[limits['count']:]]
+        entries = entries[:limits['count']]
+    if limits['size'] is not None:
+        total = 0
+        for mtime, folder in entries:
+            total += disk_usage(folder)
+            if total > limits['size']:
+                evicted.append(folder)
+    return evicted
+
+
+class Trash:
+    """
+    Folder for files and folders that are to be deleted. Moving something
+    into the trash is a cheap rename (as long as it resides on the same file
+    system), the actual deletion is performed by a detached background
+    process with the lowest I/O and CPU priority.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def put(self, path, *, reap=True):
+        """
+        Moves *path* into the trash and starts the reaper, unless *reap* is
+        `False`. Paths that no longer exist are ignored.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        target = os.path.join(self.folder, '%d-%d-%s' % (
+            os.getpid(), next(_counter), os.path.basename(path)))
+        try:
+            os.rename(path, target)
+        except FileNotFoundError:
+            # already gone, e.g. deleted by a concurrent process
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # different file system
+            try:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.unlink(path)
+            except FileNotFoundError:
+                pass
+            return
+        if reap:
+            self.reap()
+
+    def reap(self):
+        """
+        Starts a detached process deleting the current contents of the trash.
+        """
+        try:
+            entries = os.listdir(self.folder)
+        except FileNotFoundError:
+            return
+        if not entries:
+            return
+        args = ['rm', '-rf', '--'] + [
+            os.path.join(self.folder, entry) for entry in entries]
+        if shutil.which('nice'):
+            args = ['nice', '-n', '19'] + args
+        if shutil.which('ionice'):
+            args = ['ionice', '-c', '3'] + args
+        Popen(args, stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL,
+              start_new_session=True)
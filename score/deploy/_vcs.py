@@ -0,0 +1,345 @@
+# Copyright © 2015 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+import binascii
+import fnmatch
+import os
+import shlex
+import sys
+from subprocess import Popen, PIPE, DEVNULL
+
+from ._venv import manifests
+
+
+def run(commands, *, cwd):
+    """
+    Runs the given VCS *commands* in the folder *cwd* one after another and
+    returns the exit code of the first one that fails, or 0. Commands are
+    lists of arguments, or strings to be executed by the shell.
+    """
+    for command in commands:
+        proc = Popen(command, shell=isinstance(command, str), cwd=cwd,
+                     stdout=sys.stdout, stderr=sys.stderr)
+        proc.communicate()
+        if proc.returncode:
+            return proc.returncode
+    return 0
+
+
+async def arun(commands, *, cwd):
+    """
+    Awaitable variant of :func:`run`.
+    """
+    from . import _async
+    for command in commands:
+        returncode = await _async.run(command, cwd=cwd,
+                                      shell=isinstance(command, str))
+        if returncode:
+            return returncode
+    return 0
+
+
+def _is_manifest(name):
+    return name in manifests or fnmatch.fnmatch(name, 'requirements*.txt')
+
+
+class Mercurial:
+    """
+    Driver for Mercurial repositories. If a *revision* is given, only this
+    revision (and its ancestors) is fetched and deployed, otherwise the tip.
+    A list of *sparse* paths limits the working copies to these paths using
+    the sparse extension.
+    """
+
+    name = 'hg'
+    metadir = '.hg'
+    dirstate = 'dirstate'
+    mirror_suffix = ''
+
+    def __init__(self, *, revision=None, sparse=None):
+        self.revision = revision
+        self.sparse = list(sparse or [])
+        self.hg = ['hg']
+        if self.sparse:
+            self.hg += ['--config', 'extensions.sparse=']
+
+    @property
+    def target(self):
+        return self.revision or 'tip'
+
+    def _rev(self):
+        return ['-r', self.revision] if self.revision else []
+
+    def clone_mirror(self, repository, target):
+        return [self.hg + ['clone', '--noupdate'] + self._rev() +
+                [repository, target]]
+
+    def pull_mirror(self, repository):
+        return [self.hg + ['pull'] + self._rev() + [repository]]
+
+    def clone(self, mirror, target):
+        if not self.sparse:
+            # local clones hardlink the repository store of the mirror
+            updaterev = ['--updaterev', self.revision] if self.revision else []
+            return [self.hg + ['clone'] + updaterev + [mirror, target]]
+        include = []
+        for path in self.sparse:
+            include += ['--include', path]
+        return [
+            self.hg + ['clone', '--noupdate', mirror, target],
+            self.hg + ['-R', target, 'debugsparse'] + include,
+            self.hg + ['-R', target, 'update', '--clean'] + self._rev(),
+        ]
+
+    def fetch(self, mirror):
+        return [self.hg + ['pull', mirror]]
+
+    def update(self):
+        return [self.hg + ['update', '--clean'] + self._rev()]
+
+    def reset(self):
+        hg = ' '.join(shlex.quote(arg) for arg in self.hg)
+        update = ' '.join(shlex.quote(arg) for arg in
+                          ['up', '--clean'] + self._rev())
+        return ['%s st --no-status --unknown --print0 --color false | '
+                'xargs -0 rm --force && %s %s' % (hg, hg, update)]
+
+    def status(self):
+        return self.hg + ['status', '--modified', '--added', '--removed',
+                          '--deleted', '--no-status']
+
+    def working_revision(self, folder):
+        """
+        Reads the node of the working copy's parent from the dirstate.
+        """
+        try:
+            with open(os.path.join(folder, '.hg', 'dirstate'), 'rb') as fp:
+                head = fp.read(32)
+        except OSError:
+            return None
+        if head.startswith(b'dirstate-v2\n'):
+            head = head[12:]
+        if len(head) < 20:
+            return None
+        return binascii.hexlify(head[:20]).decode('ascii')
+
+    def distances(self, mirror, nodes):
+        """
+        Returns a `dict` mapping those of the given *nodes* that are known
+        to the *mirror* to their distance from the deployed revision.
+        """
+        revsets = ['-r', self.target]
+        nodes = list(nodes)
+        if nodes:
+            revsets += ['-r', ' or '.join('id(%s)' % node for node in nodes)]
+        proc = Popen(self.hg + ['log'] + revsets + ['-T', '{node} {rev}\n'],
+                     cwd=mirror, stdout=PIPE, stderr=DEVNULL)
+        out, err = proc.communicate()
+        if proc.returncode:
+            return {}
+        revisions = [line.split() for line in
+                     out.decode('ascii', 'replace').splitlines()]
+        if not revisions:
+            return {}
+        target = int(revisions[0][1])
+        return dict((node, abs(target - int(rev)))
+                    for node, rev in revisions)
+
+    def extract(self, mirror, folder):
+        """
+        Writes the files defining the dependencies of the deployed revision
+        of the *mirror* into *folder*.
+        """
+        patterns = list(manifests) + ['glob:requirements*.txt']
+        Popen(self.hg + ['cat', '-r', self.target,
+                         '--output', os.path.join(folder, '%p')] + patterns,
+              cwd=mirror, stdout=DEVNULL, stderr=DEVNULL).wait()
+
+
+class Git:
+    """
+    Driver for Git repositories. The mirror is a bare repository, which
+    contains only the branch *revision* (or all branches, if it is `None`),
+    truncated to *depth* commits, if given. A list of *sparse* paths limits
+    the working copies to these directories using a cone mode sparse
+    checkout.
+    """
+
+    name = 'git'
+    metadir = '.git'
+    dirstate = 'index'
+    mirror_suffix = '.git'
+
+    # maximum distance to the deployed commit considered in distances()
+    max_distance = 10000
+
+    def __init__(self, *, revision=None, sparse=None, depth=None):
+        self.revision = revision
+        self.sparse = list(sparse or [])
+        self.depth = depth
+
+    @property
+    def target(self):
+        if self.revision:
+            return 'refs/heads/%s' % self.revision
+        return 'HEAD'
+
+    def _depth(self):
+        return ['--depth', str(self.depth)] if self.depth else []
+
+    def clone_mirror(self, repository, target):
+        branch = []
+        if self.revision:
+            branch = ['--single-branch', '--branch', self.revision]
+        return [['git', 'clone', '--bare'] + self._depth() + branch +
+                [repository, target]]
+
+    def pull_mirror(self, repository):
+        if self.revision:
+            refspec = '+refs/heads/%s:refs/heads/%s' % (
+                self.revision, self.revision)
+        else:
+            refspec = '+refs/heads/*:refs/heads/*'
+        return [['git', 'fetch', '--prune'] + self._depth() +
+                [repository, refspec]]
+
+    def clone(self, mirror, target):
+        # local clones hardlink the objects of the mirror
+        args = ['git', 'clone']
+        if self.revision:
+            args += ['--branch', self.revision]
+        if not self.sparse:
+            return [args + [mirror, target]]
+        return [
+            args + ['--sparse', mirror, target],
+            ['git', '-C', target, 'sparse-checkout', 'set'] + self.sparse,
+        ]
+
+    def fetch(self, mirror):
+        return [['git', 'fetch', '--update-shallow', mirror, self.target]]
+
+    def update(self):
+        return [['git', 'reset', '--hard', 'FETCH_HEAD']]
+
+    def reset(self):
+        return [['git', 'reset', '--hard', 'FETCH_HEAD'],
+                ['git', 'clean', '--force', '-d']]
+
+    def status(self):
+        return ['git', 'status', '--porcelain', '--untracked-files=no']
+
+    def working_revision(self, folder):
+        """
+        Resolves the HEAD of the working copy without running git.
+        """
+        gitdir = os.path.join(folder, '.git')
+        try:
+            with open(os.path.join(gitdir, 'HEAD')) as fp:
+                head = fp.read().strip()
+            if not head.startswith('ref: '):
+                return head or None
+            ref = head[5:]
+            try:
+                with open(os.path.join(gitdir, ref)) as fp:
+                    return fp.read().strip() or None
+            except FileNotFoundError:
+                pass
+            with open(os.path.join(gitdir, 'packed-refs')) as fp:
+                for line in fp:
+                    parts = line.split()
+                    if len(parts) == 2 and parts[1] == ref:
+                        return parts[0]
+        except OSError:
+            pass
+        return None
+
+    def distances(self, mirror, nodes):
+        """
+        Returns a `dict` mapping those of the given *nodes* that are among
+        the ancestors of the deployed commit to their distance from it.
+        """
+        nodes = set(nodes)
+        proc = Popen(['git', 'rev-list', '--max-count=%d' % self.max_distance,
+                      self.target],
+                     cwd=mirror, stdout=PIPE, stderr=DEVNULL)
+        out, err = proc.communicate()
+        if proc.returncode:
+            return {}
+        return dict((node, distance) for distance, node in
+                    enumerate(out.decode('ascii', 'replace').split())
+                    if node in nodes)
+
+    def extract(self, mirror, folder):
+        """
+        Writes the files defining the dependencies of the deployed commit of
+        the *mirror* into *folder*.
+        """
+        proc = Popen(['git', 'ls-tree', '--name-only', self.target],
+                     cwd=mirror, stdout=PIPE, stderr=DEVNULL)
+        out, err = proc.communicate()
+        if proc.returncode:
+            return
+        for name in out.decode('utf-8', 'replace').splitlines():
+            if not _is_manifest(name):
+                continue
+            with open(os.path.join(folder, name), 'wb') as fp:
+                Popen(['git', 'show', '%s:%s' % (self.target, name)],
+                      cwd=mirror, stdout=fp, stderr=DEVNULL).wait()
+
+
+drivers = {
+    'hg': Mercurial,
+    'git': Git,
+}
+
+
+def detect(folder):
+    """
+    Returns a driver for the working copy in *folder*, or `None` if it is
+    not a working copy of a supported VCS.
+    """
+    if os.path.isdir(os.path.join(folder, '.git')):
+        return Git()
+    try:
+        with open(os.path.join(folder, '.hg', 'requires')) as fp:
+            requires = fp.read().split()
+    except OSError:
+        return None
+    driver = Mercurial()
+    if 'exp-sparse' in requires:
+        # the working copy can only be accessed with the sparse extension
+        driver.hg += ['--config', 'extensions.sparse=']
+    return driver
+
+
+def working_revision(folder):
+    """
+    Returns the revision the working copy in *folder* is at, or `None`.
+    """
+    driver = detect(folder)
+    if driver is None:
+        return None
+    return driver.working_revision(folder)
@@ -0,0 +1,298 @@
+# Copyright © 2015 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+
+import glob
+import hashlib
+import os
+import re
+import shutil
+from subprocess import Popen, PIPE, DEVNULL, check_output
+
+from ._trash import expired
+
+
+manifests = ('setup.py', 'setup.cfg', 'pyproject.toml')
+
+_interpreter = None
+
+
+def _virtualenv_path(venvpath):
+    """
+    Returns the path a virtualenv was created in, as recorded in its activate
+    script.
+    """
+    try:
+        with open(os.path.join(venvpath, 'bin', 'activate')) as fp:
+            for line in fp:
+                # newer virtualenv versions assign the path inside an if/else
+                match = re.match(
+                    r'''^\s*VIRTUAL_ENV=(["']?)(/[^"'$]*)\1\s*$''', line)
+                if match:
+                    return match.group(2)
+    except OSError:
+        pass
+    return None
+
+
+def _relocatable_files(venvpath):
+    """
+    Returns all files in a virtualenv that may contain its absolute path or
+    the absolute path of a develop-installed project.
+    """
+    files = [os.path.join(venvpath, 'pyvenv.cfg')]
+    bindir = os.path.join(venvpath, 'bin')
+    for name in os.listdir(bindir):
+        file = os.path.join(bindir, name)
+        if os.path.isfile(file) and not os.path.islink(file):
+            files.append(file)
+    for sitedir in glob.glob(os.path.join(
+            venvpath, 'lib', 'python*', 'site-packages')):
+        files += glob.glob(os.path.join(sitedir, '*.pth'))
+        files += glob.glob(os.path.join(sitedir, '*.egg-link'))
+        # finders of editable installs (PEP 660)
+        files += glob.glob(os.path.join(sitedir, '__editable__*.py'))
+        files += glob.glob(os.path.join(
+            sitedir, '*.dist-info', 'direct_url.json'))
+    return [file for file in files if os.path.isfile(file)]
+
+
+def _rewrite(file, old, new):
+    """
+    Replaces the path *old* in given *file* with *new*. Returns whether the
+    file was changed.
+    """
+    with open(file, 'rb') as fp:
+        content = fp.read()
+    if b'\0' in content or old not in content:
+        return False
+    # do not touch paths, that merely start with the old one
+    pattern = re.escape(old) + rb'''(?=[/"'\s]|$)'''
+    replaced = re.sub(pattern, lambda match: new, content)
+    if replaced == content:
+        return False
+    tmpfile = '%s.%d.tmp' % (file, os.getpid())
+    with open(tmpfile, 'wb') as fp:
+        fp.write(replaced)
+    shutil.copymode(file, tmpfile)
+    # renaming (instead of writing in place) breaks hard links to the file
+    os.rename(tmpfile, file)
+    return True
+
+
+def relocate(venvpath):
+    """
+    Fixes the absolute paths in a virtualenv that was moved to *venvpath*
+    together with its project folder: the scripts in its bin folder, its
+    configuration and the references to develop-installed projects in its
+    site-packages, including the finders of editable installs.
+    """
+    oldpath = _virtualenv_path(venvpath)
+    if not oldpath or oldpath == venvpath:
+        return
+    old = os.path.dirname(oldpath).encode('utf-8')
+    new = os.path.dirname(venvpath).encode('utf-8')
+    for file in _relocatable_files(venvpath):
+        if not _rewrite(file, old, new) or not file.endswith('.py'):
+            continue
+        # the bytecode would otherwise still contain the old paths, if the
+        # rewritten file happens to have the same size and modification time
+        module = os.path.splitext(os.path.basename(file))[0]
+        for pyc in glob.glob(os.path.join(
+                os.path.dirname(file), '__pycache__', module + '.*.pyc')):
+            os.unlink(pyc)
+
+
+def interpreter():
+    """
+    Returns a string identifying the python interpreter virtualenvs are
+    created with.
+    """
+    global _interpreter
+    if _interpreter is None:
+        _interpreter = check_output(
+            "/bin/bash -c 'python3 -c \"import sys; print(sys.version)\"'",
+            shell=True).decode('utf-8').strip()
+    return _interpreter
+
+
+def manifest_files(folder):
+    """
+    Returns the contents of all files in *folder* that define the
+    dependencies of a project as a `dict` mapping file names to `bytes`.
+    """
+    names = list(manifests)
+    names += [os.path.basename(file) for file in
+              glob.glob(os.path.join(folder, 'requirements*.txt'))]
+    files = {}
+    for name in names:
+        try:
+            with open(os.path.join(folder, name), 'rb') as fp:
+                files[name] = fp.read()
+        except OSError:
+            pass
+    return files
+
+
+def fingerprint(files):
+    """
+    Calculates the key of a virtualenv from the given manifest *files* (see
+    :func:`manifest_files`) and the :func:`interpreter`.
+    """
+    hash = hashlib.sha256(interpreter().encode('utf-8'))
+    for name in sorted(files):
+        hash.update(b'\0' + name.encode('utf-8') + b'\0')
+        hash.update(hashlib.sha256(files[name]).digest())
+    return hash.hexdigest()
+
+
+def read_fingerprint(venvpath):
+    """
+    Returns the fingerprint stored in a virtualenv with
+    :func:`write_fingerprint`, or `None`.
+    """
+    try:
+        with open(os.path.join(venvpath, 'deploy-fingerprint')) as fp:
+            return fp.read().strip()
+    except OSError:
+        return None
+
+
+def write_fingerprint(venvpath, fingerprint):
+    with open(os.path.join(venvpath, 'deploy-fingerprint'), 'w') as fp:
+        fp.write(fingerprint)
+
+
+def clone_tree(src, dst):
+    """
+    Creates a cheap copy of the folder *src* at *dst*. Tries a copy-on-write
+    copy first, then hard links, and falls back to copying the files.
+    Returns the method that succeeded: ``reflink``, ``hardlink`` or
+    ``copy``.
+    """
+    for method, args in (('reflink', ['cp', '-a', '--reflink=always']),
+                         ('hardlink', ['cp', '-al'])):
+        proc = Popen(args + [src, dst], stdout=DEVNULL, stderr=PIPE)
+        proc.communicate()
+        if not proc.returncode:
+            return method
+        shutil.rmtree(dst, ignore_errors=True)
+    shutil.copytree(src, dst, symlinks=True)
+    return 'copy'
+
+
+def _break_links(venvpath):
+    """
+    Replaces all files, that might get modified in place during installation,
+    with private copies: the scripts, the configuration, the files directly in
+    site-packages and the metadata of installed distributions. Files in a
+    virtualenv created by :func:`clone_tree` might be hard links to the files
+    in the cache or in another appling.
+    """
+    files = glob.glob(os.path.join(venvpath, 'bin', '*'))
+    files.append(os.path.join(venvpath, 'pyvenv.cfg'))
+    for sitedir in glob.glob(os.path.join(
+            venvpath, 'lib', 'python*', 'site-packages')):
+        files += glob.glob(os.path.join(sitedir, '*'))
+        files += glob.glob(os.path.join(sitedir, '*.dist-info', '*'))
+        files += glob.glob(os.path.join(sitedir, '*.egg-info', '*'))
+    for file in files:
+        if os.path.islink(file) or not os.path.isfile(file) or \
+                os.stat(file).st_nlink < 2:
+            continue
+        tmpfile = '%s.%d.tmp' % (file, os.getpid())
+        shutil.copy2(file, tmpfile)
+        os.rename(tmpfile, file)
+
+
+class VenvCache:
+    """
+    Cache of virtualenvs in *folder*, keyed on their :func:`fingerprint`.
+    If *limits* are given (see :func:`score.deploy._trash.expired`), the
+    least recently used virtualenvs exceeding them are moved into the
+    given :class:`Trash` whenever a virtualenv is added.
+    """
+
+    def __init__(self, folder, *, limits=None, trash=None):
+        self.folder = folder
+        self.limits = limits
+        self.trash = trash
+
+    def get(self, fingerprint, venvpath):
+        """
+        Creates a virtualenv at *venvpath* from the cached one with given
+        *fingerprint*. Returns `False` if there is no such virtualenv.
+        """
+        cached = os.path.join(self.folder, fingerprint)
+        if not os.path.isdir(cached):
+            return False
+        try:
+            # the modification time marks the last use
+            os.utime(cached)
+        except FileNotFoundError:
+            # evicted by a concurrent process
+            return False
+        clone_tree(cached, venvpath)
+        _break_links(venvpath)
+        relocate(venvpath)
+        return True
+
+    def put(self, fingerprint, venvpath):
+        """
+        Adds a copy of the virtualenv at *venvpath* to the cache.
+        """
+        cached = os.path.join(self.folder, fingerprint)
+        if os.path.isdir(cached):
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        tmpfolder = '%s.%d' % (cached, os.getpid())
+        clone_tree(venvpath, tmpfolder)
+        _break_links(tmpfolder)
+        try:
+            os.rename(tmpfolder, cached)
+        except OSError:
+            # added by a concurrent process
+            shutil.rmtree(tmpfolder)
+            return
+        # the copy kept the modification time of the original
+        os.utime(cached)
+        self.evict()
+
+    def evict(self):
+        """
+        Moves the virtualenvs exceeding the limits into the trash.
+        """
+        if self.limits is None:
+            return
+        folders = [os.path.join(self.folder, name)
+                   for name in os.listdir(self.folder)
+                   # skip the temporary folders of concurrent processes
+                   if '.' not in name]
+        evicted = expired(folders, self.limits)
+        for folder in evicted:
+            self.trash.put(folder, reap=False)
+        if evicted:
+            self.trash.reap()
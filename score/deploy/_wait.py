@@ -0,0 +1,123 @@
+# Copyright © 2015 STRG.AT GmbH, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in the
+# file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district the
+# Licensee has his registered seat, an establishment or assets.
+
+
+import os
+import select
+import time
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+_mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | \
+    IN_DELETE
+
+
+class _Inotify:
+    """
+    Minimal inotify wrapper that can wait for changes in a set of files or
+    folders. Raises an :class:`OSError` if inotify is not available.
+    """
+
+    def __init__(self, paths):
+        import ctypes
+        import ctypes.util
+        libname = ctypes.util.find_library('c')
+        if not libname:
+            raise OSError('libc not found')
+        libc = ctypes.CDLL(libname, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify not available')
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        watched = 0
+        for path in paths:
+            if libc.inotify_add_watch(
+                    self.fd, os.fsencode(path), _mask) >= 0:
+                watched += 1
+        if not watched:
+            self.close()
+            raise OSError('could not watch any of %s' % (paths,))
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if readable:
+            self.drain()
+
+    def drain(self):
+        """
+        Discards all pending events.
+        """
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+def wait_until(predicate, timeout, *, watch=()):
+    """
+    Waits until calling *predicate* returns a truthy value and returns the
+    number of seconds it took. Raises a :class:`TimeoutError` if that did
+    not happen within *timeout* seconds.
+
+    The predicate is tested again whenever one of the files or folders in
+    *watch* changes (if inotify is available), but at least with an
+    exponentially increasing interval of up to one second.
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    try:
+        inotify = _Inotify(watch) if watch else None
+    except OSError:
+        inotify = None
+    delay = 0.01
+    try:
+        while True:
+            if predicate():
+                return time.monotonic() - start
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError('Timed out after %ss' % timeout)
+            if inotify:
+                inotify.wait(min(delay, remaining))
+            else:
+                time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 1)
+    finally:
+        if inotify:
+            inotify.close()
@@ -25,100 +25,234 @@
 # Licensee has his registered seat, an establishment or assets.
 
 
+from collections import OrderedDict
+import json
 import os
-from subprocess import Popen, PIPE
+import sys
+import time
 
 import click
-import score.init
-import score.uwsgi
-from score.uwsgi.cli import zergling_status
-import time
 
-import score.deploy
-from ._app import NoSuchAppling, phonetics
+from ._config import CachedConfig
+from ._log import LogIndex, parse_time, stream, stream_window, tail_offset
+from ._names import phonetics
+from ._registry import Registry
+from ._server import Server, forward, is_listening, socket_path
+from ._status import StatusCache, collect_status
+from ._timing import summarize
 
 
 def appling_name(app_alias):
-    if len(app_alias) > 2:
+    if len(app_alias) != 2:
         return app_alias
     return '%s-%s' % (phonetics[app_alias[0]], phonetics[app_alias[1]])
 
 
 def get_appling(ctx, alias):
+    from ._app import NoSuchAppling
     parts = alias.split('/')
-    if len(parts) == 2:
-        app = ctx.deploy.apps[parts[0]]
-        return app.appling(appling_name(parts[1]))
-    found = []
-    for app in ctx.deploy.apps:
-        try:
-            appling = ctx.deploy.apps[app].appling(appling_name(parts[0]))
-            found.append(appling)
-        except NoSuchAppling:
-            pass
+    try:
+        if len(parts) == 2:
+            found = ctx.deploy.find_applings(appling_name(parts[1]),
+                                             parts[0])
+        else:
+            found = ctx.deploy.find_applings(appling_name(parts[0]))
+    except NoSuchAppling as e:
+        raise click.ClickException(str(e))
     if not found:
-        raise click.ClickException('Appling %s not found' % appling)
-    if len(found) > 2:
-        raise click.ClickException('Multiple applings with alias %s found:\n  -'
-                                   % (alias, '\n  -'.join(found)))
+        raise click.ClickException('Appling %s not found' % alias)
+    if len(found) > 1:
+        names = ['%s/%s' % (appling.app.name, appling.name)
+                 for appling in found]
+        raise click.ClickException(
+            'Multiple applings with alias %s found:\n  - %s' %
+            (alias, '\n  - '.join(names)))
     return found[0]
 
 
-@click.group()
+def locate_log(ctx, alias):
+    """
+    Returns the path to the log file of the appling with given *alias* and
+    the path to its :class:`LogIndex`. The appling is looked up in the
+    registry using the cached configuration, if possible, falling back to
+    :func:`get_appling`, which requires the full initialization. Only exact
+    names are resolved from the registry, as a prefix match might hide an
+    appling the registry does not know yet.
+    """
+    config = ctx.cached_config
+    if config is not None:
+        parts = alias.split('/')
+        app = parts[0] if len(parts) == 2 else None
+        found = Registry(os.path.join(config.statedir, 'registry.json'))\
+            .lookup(appling_name(parts[-1]), app)
+        if len(found) == 1:
+            appname, name, info = found[0]
+            link = os.path.join(info.get('folder', ''), 'zergling.log')
+            if os.path.islink(link) and os.path.exists(link):
+                return os.path.realpath(link), os.path.join(
+                    config.statedir, 'logindex', appname, '%s.json' % name)
+    appling = get_appling(ctx, alias)
+    return appling.zergling.logfile, appling.logindex.indexfile
+
+
+class _Score:
+    """
+    Lazily initialized score configuration of the file *conf*. Accessing any
+    attribute of the configuration (like ``deploy``) performs the full
+    initialization, :attr:`cached_config` tries to avoid it.
+    """
+
+    def __init__(self, conf):
+        self.conf = conf
+        self._score = None
+
+    @property
+    def score(self):
+        if self._score is None:
+            import score.init
+            self._score = score.init.init_from_file(self.conf)
+            try:
+                CachedConfig.store(self.conf, self._score.deploy,
+                                   self._files())
+            except OSError:
+                pass
+        return self._score
+
+    def _files(self):
+        """
+        Returns the configuration files score.init resolved the configuration
+        from (the bases and includes of the file).
+        """
+        try:
+            files = self._score.conf['score.init']['_files']
+        except (KeyError, TypeError):
+            return []
+        return [file for file in files.splitlines() if file.strip()]
+
+    @property
+    def cached_config(self):
+        """
+        The :class:`CachedConfig` of the configuration file, or `None` if the
+        cache is outdated.
+        """
+        if self._score is not None:
+            return CachedConfig.store(self.conf, self._score.deploy,
+                                      self._files())
+        return CachedConfig.load(self.conf)
+
+    def __getattr__(self, name):
+        return getattr(self.score, name)
+
+
+class _Group(click.Group):
+    """
+    Group remembering the command line of the invoked subcommand in the
+    context's meta data (``deploy.command_line``), so it can be forwarded to
+    the daemon.
+    """
+
+    def parse_args(self, ctx, args):
+        rest = super().parse_args(ctx, args)
+        # click>=8.2 deprecated the public attribute
+        protected = getattr(ctx, '_protected_args', None)
+        if protected is None:
+            protected = ctx.protected_args
+        ctx.meta['deploy.command_line'] = list(protected) + list(ctx.args)
+        return rest
+
+
+@click.group(cls=_Group)
+@click.option('--local', is_flag=True, default=False,
+              help='Do not forward the command to a running daemon')
+@click.option('--detach', is_flag=True, default=False,
+              help='Queue the command in the daemon and return immediately')
 @click.argument('conf', type=click.Path(file_okay=True, dir_okay=False))
 @click.pass_context
-def main(ctx, conf):
+def main(ctx, conf, local, detach):
     """
     Manages deployment processes.
     """
-    ctx.obj = score.init.init_from_file(conf)
+    if ctx.obj is not None:
+        # invoked by the daemon with an initialized configuration
+        return
+    if not local and ctx.invoked_subcommand != 'serve':
+        path = socket_path(conf)
+        if os.path.exists(path):
+            try:
+                exit_code = forward(path, ctx.meta['deploy.command_line'],
+                                    detach=detach)
+            except OSError:
+                # stale socket (daemon is not running) or a socket of
+                # another user, whose output must not be trusted
+                pass
+            else:
+                ctx.exit(exit_code)
+    if detach:
+        raise click.UsageError('--detach requires a running daemon')
+    ctx.obj = _Score(conf)
 
 
 @main.command('init')
 @click.option('-d', '--debug', is_flag=True, default=False)
+@click.option('-j', '--jobs', type=int, default=4,
+              help='Number of apps to initialize concurrently')
 @click.pass_context
-def init(ctx, debug):
+def init(ctx, debug, jobs):
     """
     First-Time initializer
     """
-    for appname in ctx.obj.deploy.apps:
-        ctx.obj.deploy.apps[appname].initialize()
+    def progress(name, error):
+        if error is None:
+            print('%s: initialized' % name)
+        else:
+            print('%s: failed (%s)' % (name, error))
+    errors = ctx.obj.deploy.initialize(jobs=jobs, callback=progress)
+    if errors:
+        raise click.ClickException('Could not initialize %s' %
+                                   ', '.join(sorted(errors)))
 
 
 @main.command('status')
+@click.option('-j', '--jobs', type=int, default=8,
+              help='Number of applings to check concurrently')
+@click.option('-t', '--timeout', type=float, default=10,
+              help='Timeout of a single check in seconds')
+@click.option('--json', 'as_json', is_flag=True, default=False,
+              help='Print machine-readable output')
+@click.option('--no-cache', is_flag=True, default=False,
+              help='Rescan all working copies')
 @click.pass_context
-def status(ctx):
+def status(ctx, jobs, timeout, as_json, no_cache):
     """
     Status info on deployment
     """
-    for name in sorted(ctx.obj.deploy.apps):
-        app = ctx.obj.deploy.apps[name]
+    deploy = ctx.obj.deploy
+    cache = None
+    if not no_cache:
+        cache = StatusCache(os.path.join(deploy.statedir, 'status.json'))
+    result = collect_status(deploy.apps, jobs=jobs, timeout=timeout,
+                            cache=cache)
+    if as_json:
+        print(json.dumps(OrderedDict(
+            (name, OrderedDict(applings)) for name, applings in result),
+            indent=2))
+        return
+    for name, applings in result:
         print(name)
-        for zergling in sorted(app.zerglings(), key=lambda z: z.name):
-            status = []
-            folder = os.path.join(app.folder, zergling.name)
-            proc = Popen(['hg', 'status',
-                          '--modified', '--added', '--removed',
-                          '--deleted', '--no-status'],
-                         cwd=folder, stdout=PIPE, stderr=PIPE)
-            out, err = proc.communicate()
-            if proc.returncode:
-                status.append(err)
-            else:
-                if out:
-                    status.append('modified')
-                status += zergling_status(zergling)
+        for ling, status in applings:
             if status:
                 status = ' (%s)' % ', '.join(status)
             else:
                 status = ''
-            print('    %s%s' % (zergling.name, status))
+            print('    %s%s' % (ling, status))
 
 
 @main.command('mkling')
+@click.option('--from', 'source', default=None, metavar='APPLING',
+              help='Copy an existing appling of the same app')
 @click.argument('app')
 @click.pass_context
-def mkling(ctx, app):
+def mkling(ctx, app, source):
     """
     Creates a new appling
     """
@@ -126,17 +260,231 @@ def mkling(ctx, app):
     if '/' in app:
         app, name = app.split('/', 1)
     app = ctx.obj.deploy.apps[app]
-    app.mkling(name=name)
+    if source is not None:
+        if '/' not in source:
+            source = '%s/%s' % (app.name, source)
+        source = get_appling(ctx.obj, source)
+    app.mkling(name=name, source=source)
+
+
+@main.command('gc')
+@click.option('-n', '--dry-run', is_flag=True, default=False,
+              help='Only print the zerglings that would be stopped')
+@click.option('-w', '--watch', type=float, default=None, metavar='SECONDS',
+              help='Repeat every SECONDS seconds until interrupted')
+@click.pass_context
+def gc(ctx, dry_run, watch):
+    """
+    Stops idle paused zerglings
+
+    Paused zerglings are stopped, least recently active first, while the
+    memory or the number of paused zerglings of an app or of the host exceed
+    the configured limits. Use `serve --gc` to run this periodically in the
+    daemon.
+    """
+    while True:
+        usages, victims = ctx.obj.deploy.collect_garbage(dry_run=dry_run)
+        for usage in victims:
+            print('%s %s/%s (%.1f MiB, idle for %ds)' % (
+                'Would stop' if dry_run else 'Stopped', usage.app.name,
+                usage.name, usage.memory / 2 ** 20, usage.idle))
+        if watch is None:
+            break
+        time.sleep(watch)
+
+
+@main.command('serve')
+@click.option('-s', '--socket', 'path', default=None,
+              help='Path of the unix socket to listen on')
+@click.option('--gc', 'gc_interval', type=float, default=None,
+              metavar='SECONDS',
+              help='Run the gc command every SECONDS seconds')
+@click.pass_context
+def serve(ctx, path, gc_interval):
+    """
+    Runs the controller daemon
+
+    All other commands are forwarded to the daemon while it is running,
+    which keeps the configuration and the state of all apps in memory.
+    Commands changing state are executed one after another.
+    """
+    conf = ctx.parent.params['conf']
+    if path is None:
+        path = socket_path(conf)
+    if is_listening(path):
+        raise click.ClickException('A daemon is already listening on %s' %
+                                   path)
+    # initialize everything before accepting connections
+    ctx.obj.deploy
+    print('Listening on %s' % path)
+    try:
+        server = Server(main, conf, ctx.obj, path)
+        if gc_interval:
+            server.schedule(['gc'], gc_interval)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+@main.command('jobs')
+def jobs():
+    """
+    Lists the jobs of the daemon
+    """
+    raise click.ClickException('No daemon running')
+
+
+@main.command('stats')
+@click.option('-n', '--last', type=int, default=1000,
+              help='Number of recent journal records to evaluate')
+@click.option('--json', 'as_json', is_flag=True, default=False,
+              help='Print machine-readable output')
+@click.argument('app', required=False)
+@click.pass_context
+def stats(ctx, last, as_json, app):
+    """
+    Durations of deployment phases
+    """
+    records = ctx.obj.deploy.journal.records(last)
+    if app:
+        records = [record for record in records if record.get('app') == app]
+    summary = summarize(records)
+    if as_json:
+        print(json.dumps(dict(
+            (name, dict(
+                (phase, dict(zip(('count', 'p50', 'p95', 'max'), values)))
+                for phase, values in phases.items()))
+            for name, phases in summary.items()), indent=2, sort_keys=True))
+        return
+    for name in sorted(summary):
+        print(name)
+        print('    %-12s %6s %9s %9s %9s' %
+              ('phase', 'count', 'p50', 'p95', 'max'))
+        for phase, values in sorted(summary[name].items()):
+            print('    %-12s %6d %8.2fs %8.2fs %8.2fs' % ((phase,) + values))
+
+
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = 'TiB'
+    return '%.1f %s' % (size, unit)
+
+
+@main.command('du')
+@click.option('--json', 'as_json', is_flag=True, default=False,
+              help='Print machine-readable output')
+@click.argument('app', required=False)
+@click.pass_context
+def du(ctx, as_json, app):
+    """
+    Disk usage of apps and applings
+
+    Files with multiple hard links are counted once. The exclusive size
+    only counts files that are not shared with other applings (or apps).
+    """
+    usage = ctx.obj.deploy.disk_usage()
+    if app:
+        if app not in usage:
+            raise click.ClickException('App %s not found' % app)
+        usage = {app: usage[app]}
+    if as_json:
+        print(json.dumps(usage, indent=2, sort_keys=True))
+        return
+    print('%-30s %12s %12s' % ('', 'size', 'exclusive'))
+    for name in sorted(usage):
+        if name == 'total':
+            continue
+        print('%-30s %12s %12s' % (name, format_size(usage[name]['size']),
+                                   format_size(usage[name]['exclusive'])))
+        folders = usage[name]['folders']
+        for folder_name in sorted(folders):
+            print('    %-26s %12s %12s' % (
+                folder_name, format_size(folders[folder_name]['size']),
+                format_size(folders[folder_name]['exclusive'])))
+    if 'total' in usage:
+        print('%-30s %12s' % ('total', format_size(usage['total'])))
+
+
+@main.command('dedup')
+@click.option('-n', '--dry-run', is_flag=True, default=False,
+              help='Only print how much space would be freed')
+@click.pass_context
+def dedup(ctx, dry_run):
+    """
+    Hard links identical files of applings
+
+    Identical files in the site-packages of virtualenvs and in the stores of
+    the repositories are replaced with hard links to a single file.
+    """
+    linked, freed = ctx.obj.deploy.deduplicate(dry_run=dry_run)
+    print('%s %d files, %s %s' % (
+        'Would link' if dry_run else 'Linked', linked,
+        'would free' if dry_run else 'freed', format_size(freed)))
+
+
+@main.command('replenish')
+@click.argument('app', required=False)
+@click.pass_context
+def replenish(ctx, app):
+    """
+    Builds missing spare folders
+    """
+    apps = ctx.obj.deploy.apps
+    if app:
+        apps = {app: apps[app]}
+    for name in sorted(apps):
+        apps[name].replenish()
 
 
 @main.command('update')
-@click.option('-f', '--force', is_flag=True, default=False)
-@click.argument('alias')
+@click.option('-f', '--force', is_flag=True, default=False,
+              help='Update a single appling even if its zergling is running')
+@click.option('-a', '--all', 'all_', is_flag=True, default=False,
+              help='Update all applings of all apps')
+@click.option('-j', '--jobs', type=int, default=4,
+              help='Number of applings to update concurrently')
+@click.option('-b', '--batch-size', type=int, default=1,
+              help='Number of running applings to reload at once')
+@click.argument('alias', required=False)
 @click.pass_context
-def update(ctx, alias, force):
+def update(ctx, alias, force, all_, jobs, batch_size):
     """
     Updates and an appling's repository
+
+    Passing --all or an alias of the form <app>/* updates all applings at
+    once and reloads the running ones in a rolling fashion, which does not
+    require --force.
     """
+    if all_ or (alias and alias.endswith('/*')):
+        if all_:
+            apps = ctx.obj.deploy.apps
+        else:
+            name = alias[:-2]
+            if name not in ctx.obj.deploy.apps:
+                raise click.ClickException('App %s not found' % name)
+            apps = {name: ctx.obj.deploy.apps[name]}
+
+        def progress(appling, error):
+            if error is None:
+                print('%s/%s: updated' % (appling.app.name, appling.name))
+            else:
+                print('%s/%s: failed (%s)' %
+                      (appling.app.name, appling.name, error))
+        failed = []
+        for name in sorted(apps):
+            errors = apps[name].update(
+                jobs=jobs, batch_size=batch_size, callback=progress)
+            failed += ['%s/%s' % (name, ling) for ling in sorted(errors)]
+        if failed:
+            raise click.ClickException('Could not update %s' %
+                                       ', '.join(failed))
+        return
+    if not alias:
+        raise click.UsageError('Either pass an alias or --all')
     appling = get_appling(ctx.obj, alias)
     if not force and appling.zergling.is_running():
         raise click.ClickException(
@@ -144,18 +492,22 @@ def update(ctx, alias, force):
     appling.update()
     if appling.zergling.is_running():
         appling.zergling.reload()
+        appling.app.invalidate()
 
 
 @main.command('start')
 @click.option('-m', '--multi-mode', is_flag=True, default=False)
+@click.option('-t', '--timeout', type=float, default=None,
+              help='Seconds to wait for the appling to come up')
 @click.argument('alias')
 @click.pass_context
-def start(ctx, alias, multi_mode):
+def start(ctx, alias, multi_mode, timeout):
     """
     Starts a dormant appling
     """
     appling = get_appling(ctx.obj, alias)
-    appling.start(pause_others=not multi_mode)
+    elapsed = appling.start(pause_others=not multi_mode, timeout=timeout)
+    print('Started in %.2fs' % elapsed)
 
 
 @main.command('pause')
@@ -165,11 +517,13 @@ def pause(ctx, alias):
     """
     Pauses a running appling
     """
+    from score.uwsgi import AlreadyPaused
     appling = get_appling(ctx.obj, alias)
     try:
         appling.zergling.pause()
-    except score.uwsgi.AlreadyPaused:
+    except AlreadyPaused:
         pass
+    appling.app.invalidate()
 
 
 @main.command('stop')
@@ -181,31 +535,66 @@ def stop(ctx, alias):
 
 
 @main.command('reload')
+@click.option('-t', '--timeout', type=float, default=None,
+              help='Seconds to wait for the appling to come up')
 @click.argument('alias')
 @click.pass_context
-def reload(ctx, alias):
+def reload(ctx, alias, timeout):
     """
     Reloads an appling
     """
     appling = get_appling(ctx.obj, alias)
-    zergling = appling.zergling
-    zergling.reload()
-    while zergling.is_starting():
-        time.sleep(0.1)
-    if not zergling.is_running():
-        raise click.ClickException('Instance did not start.')
+    if timeout is None:
+        timeout = ctx.obj.deploy.start_timeout
+    appling.zergling.reload()
+    appling.app.invalidate()
+    try:
+        elapsed = appling.wait(timeout)
+    except Exception as e:
+        raise click.ClickException(str(e))
+    print('Reloaded in %.2fs' % elapsed)
 
 
 @main.command('log')
+@click.option('-n', '--lines', type=int, default=None,
+              help='Only print the last N lines')
+@click.option('-f', '--follow', is_flag=True, default=False,
+              help='Keep printing new lines as they are written')
+@click.option('-g', '--grep', default=None,
+              help='Only print lines matching this regular expression')
+@click.option('--since', default=None,
+              help='Only print lines logged after this time '
+                   '(YYYY-MM-DD[ HH:MM[:SS]] or relative like 15m, 2h)')
+@click.option('--until', default=None,
+              help='Only print lines logged before this time')
 @click.argument('alias')
 @click.pass_context
-def log(ctx, alias):
+def log(ctx, alias, lines, follow, grep, since, until):
     """
     Prints log file of appling
     """
-    appling = get_appling(ctx.obj, alias)
-    with open(appling.zergling.logfile) as file:
-        chunk = file.read(1024)
-        while chunk:
-            print(chunk)
-            chunk = file.read(1024)
+    logfile, indexfile = locate_log(ctx.obj, alias)
+    output = sys.stdout.buffer
+    pattern = grep.encode('utf-8') if grep is not None else None
+    if since is not None or until is not None:
+        try:
+            since = parse_time(since) if since is not None else None
+            until = parse_time(until) if until is not None else None
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+        index = LogIndex(logfile, indexfile)
+        index.update()
+        start, end = index.range(since, until)
+        with open(logfile, 'rb') as file:
+            stream_window(file, output, start, end,
+                          since=since, until=until, pattern=pattern)
+        return
+    with open(logfile, 'rb') as file:
+        start = None
+        if lines is not None:
+            start = tail_offset(file, lines)
+        try:
+            stream(file, output, start=start, follow=follow,
+                   pattern=pattern)
+        except KeyboardInterrupt:
+            pass
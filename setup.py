@@ -45,6 +45,7 @@ setup(
     packages=['score', 'score.deploy'],
     namespace_packages=['score'],
     zip_safe=False,
+    python_requires='>=3.7',
     license='LGPL',
     classifiers=[
         'Development Status :: 3 - Alpha',
@@ -56,8 +57,7 @@ setup(
         'Operating System :: OS Independent',
         'Programming Language :: SQL',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.7',
         'Topic :: Software Development :: Libraries :: Application Frameworks',
     ],
     install_requires=[